@@ -6,20 +6,43 @@ Phase 2: AI-Powered Features
 Phase 3: Production Hardening
 """
 
+import csv
+import heapq
 import json
+import lzma
+import math
+import os
+import queue
+import random
+import re
+import sqlite3
+import sys
 import time
+import tracemalloc
+import zlib
 import hashlib
 import asyncio
+import functools
+import inspect
+import itertools
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any, Callable
+from typing import Deque, Dict, Iterable, List, Optional, Any, Callable
 from dataclasses import dataclass, field
 from abc import ABC, abstractmethod
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
 from enum import Enum
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-import weakref
+import contextvars
+
+try:
+    import msgpack as _msgpack
+except ImportError:  # Optional: compact binary L2 encoding
+    _msgpack = None
 
 # ============================================
 # DATACLASSES
@@ -52,6 +75,8 @@ class QueryMetrics:
     variables: Dict[str, Any]
     complexity: QueryComplexity
     cache_key: str
+    cpu_time_ms: float = 0.0
+    trace: Optional["Trace"] = None
     
     @property
     def cache_hit_rate(self) -> float:
@@ -70,23 +95,40 @@ class QueryMetrics:
 @dataclass
 class DataLoaderConfig:
     """Configuration for DataLoader."""
-    batch_size: int = 100
+    batch_size: Optional[int] = None  # Deprecated and ignored: batches flush on the tick/window or at max_batch_size
     max_batch_size: int = 500
+    batch_window_us: int = 0  # 0 = dispatch on next event-loop iteration
     cache_ttl_seconds: int = 300
+    negative_cache_ttl_seconds: int = 30  # TTL for keys batch_fn returned None for; 0 = don't cache them
     enable_request_cache: bool = True
     enable_persistent_cache: bool = False
     cache_key_prefix: str = "graphql:loader"
+    
+    def __post_init__(self):
+        if self.batch_size is not None:
+            logging.warning("DataLoaderConfig.batch_size is deprecated and ignored; "
+                            "use max_batch_size and batch_window_us")
 
 @dataclass 
 class CacheConfig:
     """Cache configuration."""
     default_ttl: int = 300
     max_size_mb: int = 100
-    eviction_policy: str = "lru"  # lru, fifo, lfu
+    eviction_policy: str = "lru"  # lru, fifo, lfu, tinylfu
     enable_compression: bool = True
-    compression_algorithm: str = "gzip"
+    compression_algorithm: str = "gzip"  # gzip (alias of zlib: zlib streams, no gzip header), zlib, lzma, none
+    compression_min_bytes: int = 512
+    serializer: str = "auto"  # auto (msgpack, in requirements.txt; json if missing), msgpack, json
     redis_url: Optional[str] = None
     local_cache_size: int = 10000
+    tag_index_ttl: int = 86400  # Lifetime of Redis tag sets; keep above the longest tagged TTL
+    enable_invalidation_bus: bool = False  # Broadcast deletes/tag invalidations to other replicas' L1
+    invalidation_channel: str = "graphql:cache:invalidate"
+    invalidation_batch_ms: int = 10
+    invalidation_max_batch: int = 500
+    disk_cache_path: Optional[str] = None  # Enables the CacheType.DISK tier (SQLite file)
+    disk_cache_max_mb: int = 1024
+    disk_compaction_interval_seconds: int = 300
 
 @dataclass
 class QueryConfig:
@@ -99,6 +141,24 @@ class QueryConfig:
     enable_query_caching: bool = True
     enable_response_caching: bool = True
     cache_ttl: int = 60
+    enable_request_coalescing: bool = True
+    coalesce_timeout_ms: int = 5000
+    stale_ttl: int = 0  # Seconds past cache_ttl a response is served stale while refreshing (0 = off)
+    max_concurrent_refreshes: int = 4
+    persisted_query_mode: str = "auto"  # off, auto (APQ), allowlist
+    persisted_query_ttl: int = 86400
+    enable_entity_tags: bool = True  # Tag cached responses with __typename:id of contained entities
+    enable_admission_control: bool = True
+    admission_initial_limit: int = 20  # Concurrency limit in cost units, adapted from latency
+    admission_min_limit: int = 4
+    admission_max_limit: int = 200
+    admission_cost_unit: int = 25  # Complexity points per unit of concurrency
+    admission_queue_size: int = 100
+    admission_queue_timeout_ms: int = 1000
+    max_entity_tags: int = 1000  # Per response; responses with more entities are not cached
+    enable_entity_store: bool = False  # Answer queries (fully or per root field) from normalized entities
+    entity_redirects: Dict[str, str] = field(default_factory=dict)  # Root field -> __typename, looked up by its id argument
+    execute_result_format: str = "envelope"  # execute_fn returns "envelope" ({"data", "errors"} or .data/.errors) or bare "data"
 
 @dataclass
 class MonitoringConfig:
@@ -109,9 +169,330 @@ class MonitoringConfig:
     error_rate_threshold: float = 0.05
     enable_alerting: bool = True
     alert_webhook: Optional[str] = None
+    alert_queue_size: int = 1000
+    alert_dedup_window_seconds: int = 60
+    alert_rate_limit_per_minute: int = 30  # Per callback
+    memory_sample_rate: float = 0.0  # Fraction of executions measured with tracemalloc (~25% slower each)
+    enable_tracing: bool = False
+    trace_sample_rate: float = 0.01  # Head-based sampling
+    trace_slow_queries: bool = True  # Always keep traces of executions over slow_query_threshold_ms
+    max_spans_per_trace: int = 1000
+    trace_buffer_size: int = 200
     enable_dashboard: bool = True
     dashboard_port: int = 9090
 
+# ============================================
+# TRACING
+# ============================================
+
+class Span:
+    """One timed operation inside a trace; offsets are ms from the trace start."""
+    __slots__ = ("span_id", "parent_id", "kind", "name", "start_ms", "end_ms", "attributes")
+    
+    def __init__(self, span_id: int, parent_id: Optional[int], kind: str, name: str,
+                 start_ms: float, attributes: Dict[str, Any]):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.kind = kind
+        self.name = name
+        self.start_ms = start_ms
+        self.end_ms: Optional[float] = None
+        self.attributes = attributes
+    
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ms if self.end_ms is not None else self.start_ms) - self.start_ms
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "kind": self.kind,
+            "name": self.name,
+            "start_ms": round(self.start_ms, 3),
+            "end_ms": round(self.end_ms, 3) if self.end_ms is not None else None,
+            "attributes": self.attributes
+        }
+
+_current_span: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar(
+    "graphql_current_span", default=None
+)
+
+class _SpanScope:
+    """Context manager opening a span and making it the parent of nested spans."""
+    __slots__ = ("trace", "span", "token")
+    
+    def __init__(self, trace: "Trace", span: Optional[Span]):
+        self.trace = trace
+        self.span = span
+        self.token = None
+    
+    def __enter__(self) -> Optional[Span]:
+        if self.span is not None:
+            self.token = _current_span.set(self.span.span_id)
+        return self.span
+    
+    def __exit__(self, exc_type, exc, tb):
+        if self.span is not None:
+            self.span.end_ms = self.trace.offset_ms()
+            if exc_type is not None:
+                self.span.attributes["error"] = exc_type.__name__
+            _current_span.reset(self.token)
+        return False
+
+class _NullSpan:
+    """No-op span scope used when the execution is not traced."""
+    __slots__ = ()
+    
+    def __enter__(self):
+        return None
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class Trace:
+    """Spans recorded for one query execution."""
+    
+    def __init__(self, trace_id: str, operation_name: str, sampled: bool, max_spans: int = 1000):
+        self.trace_id = trace_id
+        self.operation_name = operation_name
+        self.sampled = sampled  # Head sampling decision
+        self.started_at = time.time()
+        self.duration_ms = 0.0
+        self.max_spans = max_spans
+        self.dropped_spans = 0
+        self.spans: List[Span] = []
+        self._origin = time.perf_counter()
+    
+    def offset_ms(self) -> float:
+        return (time.perf_counter() - self._origin) * 1000
+    
+    def span(self, kind: str, name: str, **attributes) -> _SpanScope:
+        """Open a nested span: `with trace.span("resolver", "Query.user"): ...`"""
+        if len(self.spans) >= self.max_spans:
+            self.dropped_spans += 1
+            return _SpanScope(self, None)
+        span = Span(len(self.spans) + 1, _current_span.get(), kind, name, self.offset_ms(), attributes)
+        self.spans.append(span)
+        return _SpanScope(self, span)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "operation_name": self.operation_name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 3),
+            "sampled": self.sampled,
+            "dropped_spans": self.dropped_spans,
+            "spans": [span.to_dict() for span in self.spans]
+        }
+    
+    def to_chrome_events(self, pid: int = 1, tid: int = 1) -> List[Dict[str, Any]]:
+        """Complete ("X") events for chrome://tracing / Perfetto; timestamps in µs."""
+        base_us = self.started_at * 1e6
+        events = [{
+            "name": self.operation_name, "cat": "execution", "ph": "X",
+            "ts": base_us, "dur": self.duration_ms * 1000, "pid": pid, "tid": tid,
+            "args": {"trace_id": self.trace_id}
+        }]
+        for span in self.spans:
+            events.append({
+                "name": span.name, "cat": span.kind, "ph": "X",
+                "ts": base_us + span.start_ms * 1000, "dur": span.duration_ms * 1000,
+                "pid": pid, "tid": tid, "args": span.attributes
+            })
+        return events
+
+class Tracer:
+    """
+    Opt-in execution tracing. Traces are started per execution (head-sampled
+    at trace_sample_rate) and kept when sampled or, with trace_slow_queries,
+    when the execution turned out slow. Kept traces go to a bounded buffer.
+    """
+    
+    def __init__(self, config: MonitoringConfig):
+        self.config = config
+        self._traces: Deque[Trace] = deque(maxlen=config.trace_buffer_size)
+        self._lock = threading.Lock()
+        self._stats = {
+            "started": 0,
+            "kept_sampled": 0,
+            "kept_slow": 0,
+            "discarded": 0,
+            "dropped_spans": 0
+        }
+    
+    def start(self, operation_name: str) -> Optional[Trace]:
+        """Start a trace, or None when neither head sampling nor slow capture applies."""
+        if not self.config.enable_tracing:
+            return None
+        sampled = random.random() < self.config.trace_sample_rate
+        if not sampled and not self.config.trace_slow_queries:
+            return None
+        self._stats["started"] += 1
+        return Trace(os.urandom(8).hex(), operation_name, sampled, self.config.max_spans_per_trace)
+    
+    def finish(self, trace: Trace, duration_ms: float) -> bool:
+        """Close the trace and decide whether to keep it."""
+        trace.duration_ms = duration_ms
+        if trace.sampled:
+            self._stats["kept_sampled"] += 1
+        elif duration_ms > self.config.slow_query_threshold_ms:
+            self._stats["kept_slow"] += 1
+        else:
+            self._stats["discarded"] += 1
+            return False
+        self._stats["dropped_spans"] += trace.dropped_spans
+        with self._lock:
+            self._traces.append(trace)
+        return True
+    
+    def get_traces(self, limit: Optional[int] = None) -> List[Trace]:
+        """Kept traces, most recent last."""
+        with self._lock:
+            traces = list(self._traces)
+        return traces[-limit:] if limit else traces
+    
+    def export(self, path: str, format: str = "jsonl", traces: Optional[List[Trace]] = None) -> int:
+        """
+        Write traces to path as JSON lines (one trace per line) or as a
+        Chrome trace-event file ("chrome"). Returns the number of traces written.
+        """
+        traces = self.get_traces() if traces is None else traces
+        with open(path, "w", encoding="utf-8") as f:
+            if format == "jsonl":
+                for trace in traces:
+                    f.write(json.dumps(trace.to_dict(), default=str) + "\n")
+            elif format == "chrome":
+                events = []
+                for tid, trace in enumerate(traces, 1):
+                    events.extend(trace.to_chrome_events(tid=tid))
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+            else:
+                raise ValueError(f"Unknown trace format: {format}")
+        return len(traces)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "buffered": len(self._traces),
+            "sample_rate": self.config.trace_sample_rate
+        }
+
+def trace_span(kind: str, name: str, **attributes):
+    """Span in the current execution's trace, or a no-op when it isn't traced."""
+    ctx = _execution_context.get()
+    if ctx is None or ctx.trace is None:
+        return _NULL_SPAN
+    return ctx.trace.span(kind, name, **attributes)
+
+# ============================================
+# EXECUTION CONTEXT
+# ============================================
+
+class QueryLimitError(Exception):
+    """Query rejected by admission control or stopped for exceeding an execution limit."""
+    
+    def __init__(self, message: str, code: str):
+        super().__init__(message)
+        self.code = code
+
+@dataclass
+class ExecutionContext:
+    """
+    Per-execution counters, propagated via contextvars to DataLoaders and
+    instrumented resolvers (including tasks started during the execution).
+    """
+    operation_name: str = "anonymous"
+    wall_start: float = field(default_factory=time.perf_counter)
+    cpu_start: float = field(default_factory=time.thread_time)
+    wall_ms: float = 0.0
+    cpu_ms: float = 0.0
+    resolver_count: int = 0
+    db_queries: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    memory_bytes: int = 0
+    error_count: int = 0
+    trace: Optional[Trace] = None
+    
+    # Limits (None = unlimited), enforced as resolvers and DataLoader batches run
+    max_resolvers: Optional[int] = None
+    max_db_queries: Optional[int] = None
+    deadline: Optional[float] = None  # perf_counter
+    
+    def count_resolver(self):
+        self.resolver_count += 1
+        if self.max_resolvers is not None and self.resolver_count > self.max_resolvers:
+            raise QueryLimitError(f"Query exceeded max_resolvers ({self.max_resolvers})", "MAX_RESOLVERS")
+        self.check_deadline()
+    
+    def count_db_query(self):
+        self.db_queries += 1
+        if self.max_db_queries is not None and self.db_queries > self.max_db_queries:
+            raise QueryLimitError(f"Query exceeded max_db_queries ({self.max_db_queries})", "MAX_DB_QUERIES")
+        self.check_deadline()
+    
+    def check_deadline(self):
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise QueryLimitError("Query exceeded max_execution_time_ms", "MAX_EXECUTION_TIME")
+    
+    def remaining_ms(self) -> Optional[float]:
+        """Time left before the deadline (negative once past), None without one."""
+        if self.deadline is None:
+            return None
+        return (self.deadline - time.perf_counter()) * 1000
+    
+    def finish(self):
+        """Stop the clocks."""
+        self.wall_ms = (time.perf_counter() - self.wall_start) * 1000
+        self.cpu_ms = (time.thread_time() - self.cpu_start) * 1000
+
+_execution_context: contextvars.ContextVar[Optional[ExecutionContext]] = contextvars.ContextVar(
+    "graphql_execution_context", default=None
+)
+
+# Serializes tracemalloc sampling (see GraphQLEPerformanceOptimizer._run)
+_memory_sample_lock = threading.Lock()
+
+def current_execution() -> Optional[ExecutionContext]:
+    """ExecutionContext of the query currently executing, if any."""
+    return _execution_context.get()
+
+def instrumented_resolver(fn: Callable) -> Callable:
+    """
+    Decorator counting (and, when traced, timing) resolver invocations
+    (sync or async). Raises QueryLimitError past max_resolvers or the deadline.
+    """
+    name = fn.__qualname__
+    
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            ctx = _execution_context.get()
+            if ctx is None:
+                return await fn(*args, **kwargs)
+            ctx.count_resolver()
+            if ctx.trace is None:
+                return await fn(*args, **kwargs)
+            with ctx.trace.span("resolver", name):
+                return await fn(*args, **kwargs)
+        return async_wrapper
+    
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        ctx = _execution_context.get()
+        if ctx is None:
+            return fn(*args, **kwargs)
+        ctx.count_resolver()
+        if ctx.trace is None:
+            return fn(*args, **kwargs)
+        with ctx.trace.span("resolver", name):
+            return fn(*args, **kwargs)
+    return wrapper
+
 # ============================================
 # DATA LOADER IMPLEMENTATION
 # ============================================
@@ -127,100 +508,318 @@ class DataLoader:
     """
     Batch loader for N+1 query prevention.
     Batches multiple requests into single database query.
+    
+    Inside an execution with a deadline, batches are not dispatched once it
+    has passed, async batch functions are cancelled when it expires, and
+    batch functions accepting a budget_ms keyword get the time remaining
+    (e.g. for a statement_timeout).
+    
+    Keys batch_fn returns None for are cached for negative_cache_ttl_seconds
+    (as NOT_FOUND in the persistent tier), so lookups of missing rows don't
+    refetch. prime()/prime_many() seed the caches with rows fetched elsewhere.
     """
     
-    def __init__(self, name: str, batch_fn: Callable[[List[str]], List[Any]], config: DataLoaderConfig = None):
+    NOT_FOUND = "__graphql_loader:not_found__"  # Persistent-tier sentinel for None
+    
+    def __init__(self, name: str, batch_fn: Callable[[List[str]], List[Any]], config: DataLoaderConfig = None,
+                 cache: "LRUCache" = None, stats: Dict[str, int] = None,
+                 persistent_cache: "MultiLevelCache" = None, request_cache: bool = True):
         self.name = name
         self.batch_fn = batch_fn
         self.config = config or DataLoaderConfig()
+        self._accepts_budget = self._accepts_budget_kwarg(batch_fn)
         
         # Pending loads (batched within event loop tick)
-        self._pending: Dict[str, Any] = {}
-        self._pending_count = 0
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._dispatch_handle: Optional[asyncio.Handle] = None
+        self._batch_tasks: set = set()
         
-        # Caches
+        # Caches (persistent cache and stats may be shared across request scopes)
         self._request_cache: Dict[str, Any] = {}  # Cleared per request
-        self._cache: LRUCache = LRUCache(max_size=10000)
+        self._use_request_cache = request_cache and self.config.enable_request_cache
+        self._cache: LRUCache = cache if cache is not None else LRUCache(max_size=10000)
+        self._persistent: Optional[MultiLevelCache] = persistent_cache  # Shared L1/Redis tier
         
         # Statistics
-        self._stats = {
+        self._stats = stats if stats is not None else self._empty_stats()
+        
+        # Thread safety
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _empty_stats() -> Dict[str, int]:
+        return {
             "batches_executed": 0,
             "total_loaded": 0,
             "cache_hits": 0,
-            "cache_misses": 0
+            "cache_misses": 0,
+            "persistent_hits": 0,
+            "cancelled": 0,  # Keys failed because the execution deadline passed
+            "timeouts": 0,   # batch_fn calls cut off by the deadline
+            "negative_cached": 0,  # None results cached for negative_cache_ttl_seconds
+            "primed": 0
         }
-        
-        # Thread safety
-        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _accepts_budget_kwarg(batch_fn: Callable) -> bool:
+        try:
+            parameters = inspect.signature(batch_fn).parameters.values()
+        except (TypeError, ValueError):
+            return False
+        return any(p.name == "budget_ms" or p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters)
     
     async def load(self, key: str) -> Any:
         """Load a single item."""
+        hit, value = self._get_cached(key)
+        if hit:
+            return value
+        
+        # Queue for batch (joins an in-flight load for the same key)
+        self._stats["cache_misses"] += 1
+        future = self._pending.get(key) or self._inflight.get(key)
+        if future is None:
+            future = self._enqueue(key)
+        
+        # Wait for result
+        result = await future
+        self._remember(key, result)
+        return result
+    
+    async def load_many(self, keys: List[str]) -> List[Any]:
+        """
+        Load multiple items, results in key order.
+        All cache misses are enqueued before awaiting, so they resolve in
+        one batch (or a few max_batch_size chunks running concurrently).
+        """
+        results: List[Any] = [None] * len(keys)
+        waiting: List[tuple] = []
+        
+        for index, key in enumerate(keys):
+            hit, value = self._get_cached(key)
+            if hit:
+                results[index] = value
+                continue
+            
+            self._stats["cache_misses"] += 1
+            future = self._pending.get(key) or self._inflight.get(key)
+            if future is None:
+                future = self._enqueue(key)
+            waiting.append((index, key, future))
+        
+        if waiting:
+            loaded = await asyncio.gather(*(future for _, _, future in waiting))
+            for (index, key, _), result in zip(waiting, loaded):
+                results[index] = result
+                self._remember(key, result)
+        
+        return results
+    
+    def _get_cached(self, key: str) -> tuple[bool, Any]:
+        """Look up key in the request cache, then the persistent cache."""
+        ctx = _execution_context.get()
+        
         # Check request cache first
-        if self.config.enable_request_cache and key in self._request_cache:
+        if self._use_request_cache and key in self._request_cache:
             self._stats["cache_hits"] += 1
-            return self._request_cache[key]
+            if ctx is not None:
+                ctx.cache_hits += 1
+            return True, self._request_cache[key]
         
         # Check persistent cache
         cache_key = f"{self.name}:{key}"
         cached = self._cache.get(cache_key)
-        if cached:
+        if cached is not None:  # Entry dict; its value may be None (negative cache)
             self._stats["cache_hits"] += 1
-            self._request_cache[key] = cached
-            return cached
+            if ctx is not None:
+                ctx.cache_hits += 1
+            self._remember(key, cached["value"])
+            return True, cached["value"]
         
-        # Queue for batch
-        self._stats["cache_misses"] += 1
-        if key not in self._pending:
-            self._pending[key] = asyncio.Future()
-            self._pending_count += 1
+        if ctx is not None:
+            ctx.cache_misses += 1
+        return False, None
+    
+    def prime(self, key: str, value: Any):
+        """
+        Cache a value fetched elsewhere (e.g. by a list resolver), replacing
+        any cached one. A load queued for the key but not yet dispatched is
+        resolved with it.
+        """
+        self.prime_many({key: value})
+    
+    def prime_many(self, values: Dict[str, Any]):
+        """Prime several keys; the persistent tier is written in one call."""
+        for key, value in values.items():
+            self._store(key, value)
+            future = self._pending.pop(key, None)
+            if future is not None and not future.done():
+                future.set_result(value)
+        if self._persistent is not None:
+            self._persist(values)
+        self._stats["primed"] += len(values)
+    
+    def _store(self, key: str, value: Any):
+        """Put a loaded value in the request and local caches."""
+        self._remember(key, value)
+        ttl = self._ttl(value)
+        if ttl:
+            self._cache.set(f"{self.name}:{key}", value, ttl=ttl)
+        else:
+            self._cache.delete(f"{self.name}:{key}")
+    
+    def _persist(self, values: Dict[str, Any]):
+        """Write loaded values to the persistent tier, None as NOT_FOUND with the negative TTL."""
+        found = {self._persistent_key(k): v for k, v in values.items() if v is not None}
+        if found:
+            self._persistent.set_many(found, ttl=self.config.cache_ttl_seconds)
+        not_found = {self._persistent_key(k): self.NOT_FOUND for k, v in values.items() if v is None}
+        if not_found and self.config.negative_cache_ttl_seconds > 0:
+            self._persistent.set_many(not_found, ttl=self.config.negative_cache_ttl_seconds)
+    
+    def _remember(self, key: str, value: Any):
+        if self._use_request_cache:
+            self._request_cache[key] = value
+    
+    def _ttl(self, value: Any) -> int:
+        return self.config.negative_cache_ttl_seconds if value is None else self.config.cache_ttl_seconds
+    
+    def _enqueue(self, key: str) -> asyncio.Future:
+        """Add key to the pending batch and schedule its dispatch."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[key] = future
         
-        # Execute batch if threshold reached
-        if self._pending_count >= self.config.batch_size:
-            await self._execute_batch()
+        if len(self._pending) >= self.config.max_batch_size:
+            # Batch is full, no point waiting for the tick
+            self._dispatch()
+        elif self._dispatch_handle is None:
+            if self.config.batch_window_us > 0:
+                self._dispatch_handle = loop.call_later(
+                    self.config.batch_window_us / 1_000_000, self._dispatch
+                )
+            else:
+                self._dispatch_handle = loop.call_soon(self._dispatch)
         
-        # Wait for result
-        result = await self._pending[key]
-        self._request_cache[key] = result
-        return result
-    
-    async def load_many(self, keys: List[str]) -> List[Any]:
-        """Load multiple items."""
-        results = []
-        for key in keys:
-            results.append(await self.load(key))
-        return results
+        return future
     
-    async def _execute_batch(self):
-        """Execute batched requests."""
+    def _dispatch(self):
+        """Flush pending keys, split into chunks of max_batch_size run concurrently."""
+        if self._dispatch_handle is not None:
+            self._dispatch_handle.cancel()
+            self._dispatch_handle = None
+        
         if not self._pending:
             return
         
-        keys = list(self._pending.keys())
-        futures = [self._pending[k] for k in keys]
+        items = list(self._pending.items())
+        self._pending = {}
+        self._inflight.update(items)
+        
+        chunk_size = max(1, self.config.max_batch_size)
+        for i in range(0, len(items), chunk_size):
+            task = asyncio.ensure_future(self._execute_batch(dict(items[i:i + chunk_size])))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+    
+    async def _execute_batch(self, batch: Dict[str, asyncio.Future]):
+        """Execute one batch of requests."""
+        keys = list(batch.keys())
         
         try:
-            # Execute batch function
-            batch_results = await self.batch_fn(keys)
+            with trace_span("dataloader", f"{self.name}.batch", keys=len(keys)):
+                results = await self._fetch_batch(keys)
             
             # Set results
-            for key, result in zip(keys, batch_results):
-                cache_key = f"{self.name}:{key}"
-                self._cache.set(cache_key, result, ttl=self.config.cache_ttl_seconds)
-                self._request_cache[key] = result
-                self._pending[key].set_result(result)
-            
-            self._stats["batches_executed"] += 1
-            self._stats["total_loaded"] += len(keys)
+            for key in keys:
+                result = results[key]
+                self._store(key, result)
+                if result is None:
+                    self._stats["negative_cached"] += 1
+                if not batch[key].done():
+                    batch[key].set_result(result)
             
         except Exception as e:
+            if isinstance(e, QueryLimitError) and e.code == "MAX_EXECUTION_TIME":
+                self._stats["cancelled"] += sum(1 for future in batch.values() if not future.done())
+            
             # Set error on all pending futures
-            for key, future in zip(keys, futures):
+            for future in batch.values():
                 if not future.done():
                     future.set_exception(e)
         
-        # Clear pending
-        self._pending.clear()
-        self._pending_count = 0
+        finally:
+            for key, future in batch.items():
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+    
+    async def _fetch_batch(self, keys: List[str]) -> Dict[str, Any]:
+        """Resolve keys from the persistent tier, then batch_fn for the rest."""
+        results: Dict[str, Any] = {}
+        
+        # Nobody will read the answers once the deadline has passed
+        ctx = _execution_context.get()
+        if ctx is not None:
+            ctx.check_deadline()
+        
+        # Persistent tier: one get_many for the whole batch
+        if self._persistent is not None:
+            with trace_span("cache", f"{self.name}.get_many", keys=len(keys)):
+                stored = self._persistent.get_many([self._persistent_key(k) for k in keys])
+            for key in keys:
+                persistent_key = self._persistent_key(key)
+                if persistent_key in stored:
+                    value = stored[persistent_key]
+                    results[key] = None if value == self.NOT_FOUND else value
+            self._stats["persistent_hits"] += len(results)
+        
+        fetch_keys = [k for k in keys if k not in results]
+        if fetch_keys:
+            remaining_ms = None
+            if ctx is not None:
+                ctx.count_db_query()
+                remaining_ms = ctx.remaining_ms()
+            
+            # Execute batch function (sync or async)
+            with trace_span("batch_fn", f"{self.name}.batch_fn", keys=len(fetch_keys)):
+                if self._accepts_budget:
+                    batch_results = self.batch_fn(fetch_keys, budget_ms=remaining_ms)
+                else:
+                    batch_results = self.batch_fn(fetch_keys)
+                if inspect.isawaitable(batch_results):
+                    batch_results = await self._await_within(batch_results, remaining_ms)
+                batch_results = list(batch_results)
+            
+            if len(batch_results) != len(fetch_keys):
+                raise ValueError(
+                    f"DataLoader {self.name}: batch_fn returned {len(batch_results)} "
+                    f"results for {len(fetch_keys)} keys"
+                )
+            
+            fetched = dict(zip(fetch_keys, batch_results))
+            if self._persistent is not None:
+                self._persist(fetched)
+            results.update(fetched)
+            
+            self._stats["batches_executed"] += 1
+            self._stats["total_loaded"] += len(fetch_keys)
+        
+        return results
+    
+    async def _await_within(self, awaitable, remaining_ms: Optional[float]) -> Any:
+        """Await a batch_fn result, cancelling it at the execution deadline."""
+        if remaining_ms is None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, max(remaining_ms, 0) / 1000)
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            raise QueryLimitError(
+                f"DataLoader {self.name}: batch cancelled at max_execution_time_ms", "MAX_EXECUTION_TIME"
+            ) from None
+    
+    def _persistent_key(self, key: str) -> str:
+        return f"{self.config.cache_key_prefix}:{self.name}:{key}"
     
     def clear_request_cache(self):
         """Clear request-scoped cache."""
@@ -228,196 +827,1854 @@ class DataLoader:
     
     def get_stats(self) -> Dict:
         """Get loader statistics."""
-        total = self._stats["cache_hits"] + self._stats["cache_misses"]
-        hit_rate = (self._stats["cache_hits"] / total * 100) if total > 0 else 0
+        return self._summarize(self.name, self._stats, self._cache)
+    
+    @staticmethod
+    def _summarize(name: str, stats: Dict[str, int], cache: "LRUCache") -> Dict:
+        """Loader statistics from the (possibly shared) stats dict and LRU."""
+        total = stats["cache_hits"] + stats["cache_misses"]
+        hit_rate = (stats["cache_hits"] / total * 100) if total > 0 else 0
         
         return {
-            "name": self.name,
-            "batches_executed": self._stats["batches_executed"],
-            "total_loaded": self._stats["total_loaded"],
-            "cache_hits": self._stats["cache_hits"],
-            "cache_misses": self._stats["cache_misses"],
+            "name": name,
+            "batches_executed": stats["batches_executed"],
+            "total_loaded": stats["total_loaded"],
+            "cache_hits": stats["cache_hits"],
+            "cache_misses": stats["cache_misses"],
+            "persistent_hits": stats["persistent_hits"],
+            "cancelled": stats["cancelled"],
+            "timeouts": stats["timeouts"],
+            "negative_cached": stats["negative_cached"],
+            "primed": stats["primed"],
             "cache_hit_rate": f"{hit_rate:.1f}%",
-            "cache_size": self._cache.size()
+            "cache_size": cache.size()
         }
 
+class LoaderScope:
+    """
+    Request-scoped set of DataLoaders.
+    Loaders are created lazily on first use and their request caches are
+    dropped when the scope closes. The persistent LRU stays shared.
+    """
+    
+    def __init__(self, owner: "GraphQLEPerformanceOptimizer"):
+        self.owner = owner
+        self._loaders: Dict[str, DataLoader] = {}
+    
+    def get(self, name: str) -> Optional[DataLoader]:
+        """Get this request's loader, creating it on first use."""
+        loader = self._loaders.get(name)
+        if loader is None:
+            loader = self.owner._new_loader(name)
+            if loader is not None:
+                self._loaders[name] = loader
+        return loader
+    
+    def close(self):
+        """Drop request-scoped state."""
+        for loader in self._loaders.values():
+            loader.clear_request_cache()
+        self._loaders.clear()
+
+# Active loader scope for the current request (task/thread-local via contextvars)
+_loader_scope: contextvars.ContextVar[Optional[LoaderScope]] = contextvars.ContextVar(
+    "graphql_loader_scope", default=None
+)
+
 # ============================================
 # CACHE IMPLEMENTATIONS
 # ============================================
 
-class LRUCache:
-    """Thread-safe LRU Cache."""
+class LocalCache:
+    """
+    Thread-safe in-process cache base.
+    O(1) get/set/delete via an ordered hash map, with per-entry TTL
+    enforced on read and an optional byte budget alongside the entry limit.
+    Subclasses choose the eviction victim through the _on_* hooks; the base
+    order is insertion order (FIFO).
+    """
     
-    def __init__(self, max_size: int = 10000):
+    policy = "fifo"
+    
+    def __init__(self, max_size: int = 10000, max_bytes: Optional[int] = None):
         self._max_size = max_size
-        self._cache: Dict[str, Any] = {}
-        self._order: List[str] = []
+        self._max_bytes = max_bytes
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
         self._lock = threading.Lock()
+        
+        # Called with the key whenever an entry leaves the cache (under the lock)
+        self.removal_listener: Optional[Callable[[str], None]] = None
+        
+        # Statistics
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0
+        }
     
-    def get(self, key: str) -> Optional[Any]:
-        """Get item from cache."""
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get entry from cache (dict with value/expires/created)."""
         with self._lock:
-            if key in self._cache:
-                # Move to end (most recently used)
-                self._order.remove(key)
-                self._order.append(key)
-                return self._cache[key]
-            return None
+            entry = self._cache.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                self._on_miss(key)
+                return None
+            
+            if entry["expires"] is not None and entry["expires"] <= time.monotonic():
+                self._remove(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                self._on_miss(key)
+                return None
+            
+            self._on_hit(key)
+            self._stats["hits"] += 1
+            return entry
+    
+    def peek(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get entry without touching stats, policy state or expiry."""
+        with self._lock:
+            return self._cache.get(key)
     
     def set(self, key: str, value: Any, ttl: int = None):
-        """Set item in cache."""
+        """Set item in cache. Values are only sized when there is a byte budget."""
+        size = _estimate_size(value) if self._max_bytes is not None else 0
+        entry = {
+            "value": value,
+            "expires": time.monotonic() + ttl if ttl else None,
+            "created": datetime.now(),
+            "size": size
+        }
         with self._lock:
-            if key in self._cache:
-                self._order.remove(key)
-            elif len(self._order) >= self._max_size:
-                # Evict oldest
-                evict_key = self._order.pop(0)
-                del self._cache[evict_key]
-            
-            self._cache[key] = {
-                "value": value,
-                "expires": datetime.now() + timedelta(seconds=ttl) if ttl else None,
-                "created": datetime.now()
-            }
-            self._order.append(key)
+            previous = self._cache.get(key)
+            if previous is not None:
+                # Update in place, keeping the key's policy state
+                self._bytes -= previous["size"]
+                self._cache[key] = entry
+                self._on_hit(key)
+            else:
+                self._cache[key] = entry
+                self._on_insert(key)
+            self._bytes += size
+            self._evict()
     
     def delete(self, key: str) -> bool:
         """Delete item from cache."""
         with self._lock:
             if key in self._cache:
-                self._order.remove(key)
-                del self._cache[key]
+                self._remove(key)
                 return True
             return False
     
     def clear(self):
         """Clear all items."""
         with self._lock:
-            self._cache.clear()
-            self._order.clear()
+            for key in list(self._cache):
+                self._remove(key)
+            self._bytes = 0
     
     def size(self) -> int:
         """Get cache size."""
         with self._lock:
             return len(self._cache)
     
+    def _remove(self, key: str):
+        """Remove entry and release its bytes. Caller holds the lock."""
+        entry = self._cache.pop(key)
+        self._bytes -= entry["size"]
+        self._on_remove(key)
+        if self.removal_listener is not None:
+            self.removal_listener(key)
+    
+    def _evict(self):
+        """Evict entries chosen by the policy until within limits. Caller holds the lock."""
+        while self._cache and (
+            len(self._cache) > self._max_size or
+            (self._max_bytes is not None and self._bytes > self._max_bytes)
+        ):
+            self._remove(self._victim())
+            self._stats["evictions"] += 1
+    
+    # Policy hooks (caller holds the lock)
+    
+    def _on_hit(self, key: str):
+        pass
+    
+    def _on_miss(self, key: str):
+        pass
+    
+    def _on_insert(self, key: str):
+        pass
+    
+    def _on_remove(self, key: str):
+        pass
+    
+    def _victim(self) -> str:
+        return next(iter(self._cache))
+    
     def get_stats(self) -> Dict:
         """Get cache statistics."""
         with self._lock:
             return {
+                "policy": self.policy,
                 "size": len(self._cache),
                 "max_size": self._max_size,
-                "utilization": f"{len(self._cache) / self._max_size * 100:.1f}%"
+                "bytes": self._bytes,  # 0 without max_bytes (values aren't sized)
+                "max_bytes": self._max_bytes,
+                "utilization": f"{len(self._cache) / self._max_size * 100:.1f}%",
+                "hits": self._stats["hits"],
+                "misses": self._stats["misses"],
+                "evictions": self._stats["evictions"],
+                "expirations": self._stats["expirations"]
             }
 
-class MultiLevelCache:
+class FIFOCache(LocalCache):
+    """Evicts in insertion order; reads don't affect order."""
+    policy = "fifo"
+
+class LRUCache(LocalCache):
+    """Thread-safe LRU Cache."""
+    policy = "lru"
+    
+    def _on_hit(self, key: str):
+        # Mark as most recently used
+        self._cache.move_to_end(key)
+
+class LFUCache(LocalCache):
     """
-    Multi-level cache with L1 (memory) and L2 (Redis/disk).
+    Least-frequently-used eviction in O(1) using frequency buckets.
+    Ties are broken by least recent use within the bucket.
     """
+    policy = "lfu"
     
-    def __init__(self, config: CacheConfig):
-        self.config = config
-        self._l1 = LRUCache(max_size=config.local_cache_size)
-        
-        # L2 cache (Redis if configured)
-        self._redis = None
-        self._redis_available = False
-        self._init_redis()
-        
-        # Statistics
-        self._stats = {
-            "l1_hits": 0,
-            "l2_hits": 0,
-            "misses": 0,
-            "sets": 0
-        }
+    def __init__(self, max_size: int = 10000, max_bytes: Optional[int] = None):
+        super().__init__(max_size, max_bytes)
+        self._freq: Dict[str, int] = {}
+        self._buckets: Dict[int, "OrderedDict[str, None]"] = defaultdict(OrderedDict)
+        self._min_freq = 0
     
-    def _init_redis(self):
-        """Initialize Redis connection."""
-        if self.config.redis_url:
-            try:
-                import redis
-                self._redis = redis.from_url(self.config.redis_url)
-                self._redis.ping()
-                self._redis_available = True
-            except Exception as e:
-                logging.warning(f"Redis unavailable: {e}")
-                self._redis_available = False
+    def _on_insert(self, key: str):
+        self._freq[key] = 1
+        self._buckets[1][key] = None
+        self._min_freq = 1
     
-    def get(self, key: str) -> Optional[Any]:
-        """Get from multi-level cache."""
-        # L1 (memory)
-        l1_result = self._l1.get(key)
-        if l1_result:
-            self._stats["l1_hits"] += 1
-            return l1_result["value"]
-        
-        # L2 (Redis)
-        if self._redis_available:
-            try:
-                l2_result = self._redis.get(key)
-                if l2_result:
-                    self._stats["l2_hits"] += 1
-                    # Promote to L1
-                    data = json.loads(l2_result)
-                    self._l1.set(key, data["value"])
-                    return data["value"]
-            except Exception:
-                pass
-        
-        self._stats["misses"] += 1
-        return None
+    def _on_hit(self, key: str):
+        freq = self._freq[key]
+        bucket = self._buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[freq]
+            if self._min_freq == freq:
+                self._min_freq = freq + 1
+        self._freq[key] = freq + 1
+        self._buckets[freq + 1][key] = None
     
-    def set(self, key: str, value: Any, ttl: int = None):
-        """Set in multi-level cache."""
-        ttl = ttl or self.config.default_ttl
-        data = {
-            "value": value,
-            "expires": (datetime.now() + timedelta(seconds=ttl)).isoformat()
-        }
-        
-        # L1
-        self._l1.set(key, value, ttl=ttl)
-        
-        # L2
-        if self._redis_available:
-            try:
-                self._redis.setex(key, ttl, json.dumps(data))
-            except Exception:
-                pass
-        
-        self._stats["sets"] += 1
+    def _on_remove(self, key: str):
+        freq = self._freq.pop(key)
+        bucket = self._buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[freq]
     
-    def delete(self, key: str) -> bool:
-        """Delete from all cache levels."""
-        l1_deleted = self._l1.delete(key)
-        
-        if self._redis_available:
-            try:
-                self._redis.delete(key)
-            except Exception:
-                pass
-        
-        return l1_deleted
+    def _victim(self) -> str:
+        if self._min_freq not in self._buckets:
+            self._min_freq = min(self._buckets)
+        return next(iter(self._buckets[self._min_freq]))
+
+class FrequencySketch:
+    """
+    Count-min sketch of access frequency for TinyLFU admission.
+    Four rows of saturating 4-bit-range counters; all counters are halved
+    after 10x capacity increments so old popularity ages out.
+    """
+    
+    _SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93)
+    _HALVE = bytes(i >> 1 for i in range(256))
+    _MAX_COUNT = 15
+    
+    def __init__(self, capacity: int):
+        width = 16
+        while width < capacity:
+            width <<= 1
+        self._mask = width - 1
+        self._rows = [bytearray(width) for _ in self._SEEDS]
+        self._sample_size = 10 * max(capacity, 16)
+        self._additions = 0
+    
+    def _indexes(self, key: str):
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        return [((h * seed) & 0xFFFFFFFFFFFFFFFF) >> 40 & self._mask for seed in self._SEEDS]
+    
+    def increment(self, key: str):
+        added = False
+        for row, index in zip(self._rows, self._indexes(key)):
+            if row[index] < self._MAX_COUNT:
+                row[index] += 1
+                added = True
+        if added:
+            self._additions += 1
+            if self._additions >= self._sample_size:
+                self._age()
+    
+    def estimate(self, key: str) -> int:
+        return min(row[index] for row, index in zip(self._rows, self._indexes(key)))
+    
+    def _age(self):
+        for row in self._rows:
+            row[:] = row.translate(self._HALVE)
+        self._additions //= 2
+
+class TinyLFUCache(LocalCache):
+    """
+    W-TinyLFU: a small LRU admission window in front of a segmented LRU
+    main area (probation/protected). When the window overflows, its oldest
+    entry only enters the main area if the frequency sketch rates it above
+    the main area's victim, so one-off scans can't flush the hot set.
+    """
+    policy = "tinylfu"
+    
+    WINDOW_RATIO = 0.01
+    PROTECTED_RATIO = 0.8
+    
+    def __init__(self, max_size: int = 10000, max_bytes: Optional[int] = None):
+        super().__init__(max_size, max_bytes)
+        self._window_max = max(1, int(max_size * self.WINDOW_RATIO))
+        self._main_max = max(1, max_size - self._window_max)
+        self._protected_max = max(1, int(self._main_max * self.PROTECTED_RATIO))
+        self._window: "OrderedDict[str, None]" = OrderedDict()
+        self._probation: "OrderedDict[str, None]" = OrderedDict()
+        self._protected: "OrderedDict[str, None]" = OrderedDict()
+        self._sketch = FrequencySketch(max_size)
+        self._admission_rejections = 0
+    
+    def _on_miss(self, key: str):
+        self._sketch.increment(key)
+    
+    def _on_hit(self, key: str):
+        self._sketch.increment(key)
+        if key in self._window:
+            self._window.move_to_end(key)
+        elif key in self._probation:
+            # Second hit in main area: promote, demoting protected overflow
+            del self._probation[key]
+            self._protected[key] = None
+            if len(self._protected) > self._protected_max:
+                demoted, _ = self._protected.popitem(last=False)
+                self._probation[demoted] = None
+        else:
+            self._protected.move_to_end(key)
+    
+    def _on_insert(self, key: str):
+        self._window[key] = None
+        # Move window overflow into main area while it has room
+        while len(self._window) > self._window_max and \
+                len(self._probation) + len(self._protected) < self._main_max:
+            candidate, _ = self._window.popitem(last=False)
+            self._probation[candidate] = None
+    
+    def _on_remove(self, key: str):
+        for segment in (self._window, self._probation, self._protected):
+            if key in segment:
+                del segment[key]
+                return
+    
+    def _main_victim(self) -> Optional[str]:
+        for segment in (self._probation, self._protected):
+            if segment:
+                return next(iter(segment))
+        return None
+    
+    def _victim(self) -> str:
+        main_victim = self._main_victim()
+        if self._window and (len(self._window) > self._window_max or main_victim is None):
+            candidate = next(iter(self._window))
+            if main_victim is None:
+                return candidate
+            # Admission: the more frequent of candidate and victim stays
+            if self._sketch.estimate(candidate) > self._sketch.estimate(main_victim):
+                del self._window[candidate]
+                self._probation[candidate] = None
+                return main_victim
+            self._admission_rejections += 1
+            return candidate
+        return main_victim
     
     def get_stats(self) -> Dict:
         """Get cache statistics."""
-        total = self._stats["l1_hits"] + self._stats["l2_hits"] + self._stats["misses"]
+        stats = super().get_stats()
+        stats["admission_rejections"] = self._admission_rejections
+        return stats
+
+EVICTION_POLICIES: Dict[str, type] = {
+    "lru": LRUCache,
+    "fifo": FIFOCache,
+    "lfu": LFUCache,
+    "tinylfu": TinyLFUCache,
+}
+
+def create_local_cache(policy: str = "lru", max_size: int = 10000,
+                       max_bytes: Optional[int] = None) -> LocalCache:
+    """Build an in-process cache for an eviction policy name."""
+    cache_cls = EVICTION_POLICIES.get(policy.lower())
+    if cache_cls is None:
+        raise ValueError(f"Unknown eviction policy: {policy} (expected one of {', '.join(EVICTION_POLICIES)})")
+    return cache_cls(max_size=max_size, max_bytes=max_bytes)
+
+def _estimate_size(value: Any) -> int:
+    """
+    Approximate in-memory size of a cached value in bytes.
+    Walks the whole structure (no depth cap, so wrapped responses count
+    their rows); shared and cyclic containers are counted once.
+    """
+    getsizeof = sys.getsizeof
+    containers = (list, tuple, set, frozenset)
+    size = 0
+    seen: set = set()
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            if id(item) in seen:
+                continue
+            seen.add(id(item))
+            for k, v in item.items():
+                size += getsizeof(k)
+                stack.append(v)
+        elif isinstance(item, containers):
+            if id(item) in seen:
+                continue
+            seen.add(id(item))
+            stack.extend(item)
+        size += getsizeof(item)
+    return size
+
+class CacheCodec:
+    """
+    Serializer + compression for L2 cache payloads.
+    Layout: magic byte, header byte (serializer id << 4 | compression id), body.
+    Bodies below min_compress_bytes, or that don't shrink, are stored uncompressed.
+    Entries written in the legacy JSON envelope format are still readable.
+    """
+    
+    MAGIC = 0xC5
+    SERIALIZERS = {"json": 0, "msgpack": 1}
+    COMPRESSORS = {"none": 0, "gzip": 1, "zlib": 1, "lzma": 2}  # "gzip" writes zlib streams
+    COMPRESSOR_NAMES = {0: "none", 1: "zlib", 2: "lzma"}
+    
+    def __init__(self, serializer: str = "auto", compression: str = "gzip",
+                 min_compress_bytes: int = 512):
+        if serializer == "auto":
+            serializer = "msgpack" if _msgpack is not None else "json"
+        if serializer not in self.SERIALIZERS:
+            raise ValueError(f"Unknown serializer: {serializer}")
+        if serializer == "msgpack" and _msgpack is None:
+            raise ValueError("msgpack serializer requested but msgpack is not installed")
+        if compression not in self.COMPRESSORS:
+            raise ValueError(f"Unknown compression algorithm: {compression}")
+        
+        self.serializer = serializer
+        self.compression = compression
+        self.min_compress_bytes = min_compress_bytes
+        self._serializer_id = self.SERIALIZERS[serializer]
+        self._compression_id = self.COMPRESSORS[compression]
+    
+    @classmethod
+    def from_config(cls, config: CacheConfig) -> "CacheCodec":
+        """Build codec from cache config."""
+        return cls(
+            serializer=config.serializer,
+            compression=config.compression_algorithm if config.enable_compression else "none",
+            min_compress_bytes=config.compression_min_bytes
+        )
+    
+    def encode(self, value: Any) -> bytes:
+        """
+        Serialize and (if worthwhile) compress a value. Raises TypeError/
+        ValueError for values the serializer can't represent (datetime,
+        Decimal, ...) rather than changing their type.
+        """
+        if self._serializer_id == 1:
+            body = _msgpack.packb(value, use_bin_type=True)
+        else:
+            body = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        
+        compression_id = 0
+        if self._compression_id and len(body) >= self.min_compress_bytes:
+            compressed = self._compress(body, self._compression_id)
+            if len(compressed) < len(body):
+                body = compressed
+                compression_id = self._compression_id
+        
+        return bytes((self.MAGIC, (self._serializer_id << 4) | compression_id)) + body
+    
+    def decode(self, payload: bytes) -> Any:
+        """Decode a payload written by encode() or the legacy JSON format."""
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        if not payload or payload[0] != self.MAGIC:
+            # Legacy format: {"value": ..., "expires": "<iso>"}
+            return json.loads(payload)["value"]
+        
+        header = payload[1]
+        serializer_id, compression_id = header >> 4, header & 0x0F
+        body = payload[2:]
+        if compression_id == 1:
+            body = zlib.decompress(body)
+        elif compression_id == 2:
+            body = lzma.decompress(body)
+        
+        if serializer_id == 1:
+            if _msgpack is None:
+                raise ValueError("msgpack payload found but msgpack is not installed")
+            return _msgpack.unpackb(body, raw=False, strict_map_key=False)
+        return json.loads(body)
+    
+    @staticmethod
+    def _compress(body: bytes, compression_id: int) -> bytes:
+        if compression_id == 2:
+            return lzma.compress(body, preset=1)
+        return zlib.compress(body, 3)
+    
+    def describe(self) -> str:
+        """Codec name for stats (the format actually written, so "gzip" shows as zlib)."""
+        return f"{self.serializer}+{self.COMPRESSOR_NAMES[self._compression_id]}"
+
+class DiskCache:
+    """
+    Persistent local cache tier (CacheType.DISK) on SQLite.
+    Entries are stored as encoded payloads with a wall-clock expiry, so they
+    survive restarts. Writes are transactions on a WAL journal (a crash
+    loses at most the last commits, never consistency); a corrupt file is
+    moved aside and recreated. A background thread compacts: it drops
+    expired entries and, over max_bytes, the ones expiring soonest.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL,
+            expires REAL NOT NULL,
+            size INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires);
+        CREATE TABLE IF NOT EXISTS tags (
+            tag TEXT NOT NULL,
+            key TEXT NOT NULL,
+            PRIMARY KEY (tag, key)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS tags_key ON tags (key);
+    """
+    
+    CHUNK = 500  # Keys per IN (...) clause
+    
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024 * 1024,
+                 compaction_interval_seconds: int = 300):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.compaction_interval_seconds = compaction_interval_seconds
+        self._lock = threading.Lock()
+        self._conn = self._open()
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "write_errors": 0,
+            "compactions": 0,
+            "expired_removed": 0,
+            "evicted": 0
+        }
+        
+        self._running = True
+        self._wakeup = threading.Event()
+        self._thread = None
+        if compaction_interval_seconds > 0:
+            self._thread = threading.Thread(target=self._compaction_loop, name="disk-cache-compaction", daemon=True)
+            self._thread.start()
+    
+    def _open(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            return self._connect()
+        except sqlite3.DatabaseError as e:
+            corrupt = self.path.with_name(f"{self.path.name}.corrupt-{int(time.time())}")
+            logging.warning(f"Disk cache {self.path} unreadable ({e}), moving it to {corrupt}")
+            self.path.replace(corrupt)
+            for suffix in ("-wal", "-shm"):
+                Path(f"{self.path}{suffix}").unlink(missing_ok=True)
+            return self._connect()
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), timeout=5, isolation_level=None, check_same_thread=False)
+        try:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")  # Only takes effect on a new file
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA mmap_size = 268435456")
+            conn.executescript(self.SCHEMA)
+        except sqlite3.DatabaseError:
+            conn.close()
+            raise
+        return conn
+    
+    def get_many(self, keys: List[str]) -> Dict[str, tuple]:
+        """{key: (payload, remaining_ttl_seconds)} for live entries."""
+        now = time.time()
+        found: Dict[str, tuple] = {}
+        with self._lock:
+            for i in range(0, len(keys), self.CHUNK):
+                chunk = keys[i:i + self.CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT key, value, expires FROM entries "
+                    f"WHERE key IN ({','.join('?' * len(chunk))}) AND expires > ?",
+                    (*chunk, now)
+                ).fetchall()
+                for key, value, expires in rows:
+                    found[key] = (value, expires - now)
+        self._stats["hits"] += len(found)
+        self._stats["misses"] += len(keys) - len(found)
+        return found
+    
+    def set_many(self, items: Dict[str, bytes], ttl: float,
+                 tags: Optional[Dict[str, Iterable[str]]] = None):
+        """Write payloads (and their tags) in one transaction."""
+        expires = time.time() + ttl
+        tags = tags or {}
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                replaced = self._stored_size(list(items))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO entries (key, value, expires, size) VALUES (?, ?, ?, ?)",
+                    [(key, payload, expires, len(payload)) for key, payload in items.items()]
+                )
+                tagged = [key for key in items if tags.get(key)]
+                if tagged:
+                    self._conn.executemany("DELETE FROM tags WHERE key = ?", [(key,) for key in tagged])
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO tags (tag, key) VALUES (?, ?)",
+                        [(tag, key) for key in tagged for tag in tags[key]]
+                    )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                self._rollback()
+                self._stats["write_errors"] += 1
+                logging.warning(f"Disk cache write failed: {e}")
+                return
+            self._bytes += sum(len(payload) for payload in items.values()) - replaced
+        self._stats["writes"] += len(items)
+        if self._bytes > self.max_bytes:
+            self._wakeup.set()
+    
+    def delete_many(self, keys: Iterable[str]) -> int:
+        """Delete keys and their tag rows. Returns entries removed."""
+        keys = list(keys)
+        removed = 0
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                freed = self._stored_size(keys)
+                for i in range(0, len(keys), self.CHUNK):
+                    chunk = keys[i:i + self.CHUNK]
+                    placeholders = ','.join('?' * len(chunk))
+                    self._conn.execute(f"DELETE FROM tags WHERE key IN ({placeholders})", chunk)
+                    removed += self._conn.execute(f"DELETE FROM entries WHERE key IN ({placeholders})", chunk).rowcount
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                self._rollback()
+                self._stats["write_errors"] += 1
+                logging.warning(f"Disk cache delete failed: {e}")
+                return 0
+            self._bytes -= freed
+        return removed
+    
+    def _stored_size(self, keys: List[str]) -> int:
+        """Total size of the entries currently stored under keys. Caller holds the lock."""
+        total = 0
+        for i in range(0, len(keys), self.CHUNK):
+            chunk = keys[i:i + self.CHUNK]
+            total += self._conn.execute(
+                f"SELECT COALESCE(SUM(size), 0) FROM entries WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchone()[0]
+        return total
+    
+    def keys_for_tags(self, tags: Iterable[str]) -> set:
+        """Keys stored under any of tags."""
+        tags = list(tags)
+        keys: set = set()
+        with self._lock:
+            for i in range(0, len(tags), self.CHUNK):
+                chunk = tags[i:i + self.CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT key FROM tags WHERE tag IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                keys.update(row[0] for row in rows)
+        return keys
+    
+    def _rollback(self):
+        try:
+            self._conn.execute("ROLLBACK")
+        except sqlite3.Error:
+            pass
+    
+    def compact(self) -> Dict[str, int]:
+        """Drop expired entries, evict soonest-expiring ones over max_bytes, reclaim space."""
+        now = time.time()
+        evicted = 0
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.execute(
+                    "DELETE FROM tags WHERE key IN (SELECT key FROM entries WHERE expires <= ?)", (now,)
+                )
+                expired = self._conn.execute("DELETE FROM entries WHERE expires <= ?", (now,)).rowcount
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+                
+                # Over budget: evict down to 90% in expiry order
+                target = self.max_bytes * 0.9
+                while total > self.max_bytes or (evicted and total > target):
+                    rows = self._conn.execute(
+                        "SELECT key, size FROM entries ORDER BY expires LIMIT ?", (self.CHUNK,)
+                    ).fetchall()
+                    if not rows:
+                        break
+                    victims = []
+                    for key, size in rows:
+                        victims.append(key)
+                        total -= size
+                        if total <= target:
+                            break
+                    placeholders = ','.join('?' * len(victims))
+                    self._conn.execute(f"DELETE FROM tags WHERE key IN ({placeholders})", victims)
+                    self._conn.execute(f"DELETE FROM entries WHERE key IN ({placeholders})", victims)
+                    evicted += len(victims)
+                self._conn.execute("COMMIT")
+                self._bytes = total
+                
+                self._conn.execute("PRAGMA incremental_vacuum").fetchall()
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error as e:
+                self._rollback()
+                logging.warning(f"Disk cache compaction failed: {e}")
+                return {"expired": 0, "evicted": 0}
+        
+        self._stats["compactions"] += 1
+        self._stats["expired_removed"] += expired
+        self._stats["evicted"] += evicted
+        return {"expired": expired, "evicted": evicted}
+    
+    def _compaction_loop(self):
+        while self._running:
+            self._wakeup.wait(self.compaction_interval_seconds)
+            self._wakeup.clear()
+            if self._running:
+                self.compact()
+    
+    def close(self):
+        self._running = False
+        self._wakeup.set()
+        with self._lock:
+            self._conn.close()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {
+            "path": str(self.path),
+            "entries": entries,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            **self._stats
+        }
+
+class MultiLevelCache:
+    """
+    Multi-level cache with L1 (memory) and L2 (Redis/disk).
+    Reads go L1 -> Redis, falling back to the disk tier (if configured)
+    when Redis is unavailable or failing; writes and deletes go to every
+    tier, so the disk tier stays warm for restarts and Redis outages.
+    """
+    
+    def __init__(self, config: CacheConfig):
+        self.config = config
+        self._l1 = create_local_cache(
+            config.eviction_policy,
+            max_size=config.local_cache_size,
+            max_bytes=config.max_size_mb * 1024 * 1024
+        )
+        
+        # Reverse tag index for L1-resident keys (tag -> keys, key -> tags).
+        # Lock order: L1 lock, then _tag_lock (the removal listener runs under the L1 lock).
+        self._tag_index: Dict[str, set] = defaultdict(set)
+        self._key_tags: Dict[str, frozenset] = {}
+        self._tag_lock = threading.Lock()
+        self._l1.removal_listener = self._untag
+        
+        # L2 cache (Redis if configured)
+        self._redis = None
+        self._redis_available = False
+        self._codec = CacheCodec.from_config(config)
+        self._init_redis()
+        
+        # Disk tier (CacheType.DISK)
+        self._disk: Optional[DiskCache] = None
+        if config.disk_cache_path:
+            self._disk = DiskCache(
+                config.disk_cache_path,
+                max_bytes=config.disk_cache_max_mb * 1024 * 1024,
+                compaction_interval_seconds=config.disk_compaction_interval_seconds
+            )
+        
+        # Tombstones: key -> wall-clock time of its last invalidation, so a
+        # concurrent L2 read can't promote a value from before it into L1
+        self._tombstones: "OrderedDict[str, float]" = OrderedDict()
+        self._tombstone_lock = threading.Lock()
+        
+        # Cross-replica invalidation (Redis pub/sub unless another transport is attached)
+        self._bus: Optional[InvalidationBus] = None
+        if config.enable_invalidation_bus and self._redis_available:
+            self.attach_invalidation_bus(RedisPubSubTransport(self._redis, config.invalidation_channel))
+        
+        # Statistics
+        self._stats = {
+            "l1_hits": 0,
+            "l2_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "l2_round_trips": 0,
+            "tagged_sets": 0,
+            "invalidations": 0,
+            "invalidated_keys": 0,
+            "promotions_suppressed": 0,
+            "unserializable": 0  # Sets kept in L1 only (value can't be encoded)
+        }
+    
+    def _init_redis(self):
+        """Initialize Redis connection."""
+        if self.config.redis_url:
+            try:
+                import redis
+                self._redis = redis.from_url(self.config.redis_url)
+                self._redis.ping()
+                self._redis_available = True
+            except Exception as e:
+                logging.warning(f"Redis unavailable: {e}")
+                self._redis_available = False
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Get from multi-level cache."""
+        # L1 (memory)
+        l1_result = self._l1.get(key)
+        if l1_result:
+            self._stats["l1_hits"] += 1
+            return l1_result["value"]
+        
+        # L2 (Redis, or disk when Redis is out)
+        found = self._fetch_lower([key])
+        if key in found:
+            return found[key]
+        
+        self._stats["misses"] += 1
+        return None
+    
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """
+        Get many keys from multi-level cache.
+        L1 is checked for every key, the L1 misses are fetched from Redis in
+        one pipelined round trip and promoted to L1. Returns found keys only.
+        """
+        found: Dict[str, Any] = {}
+        missing: List[str] = []
+        
+        # L1 (memory)
+        for key in dict.fromkeys(keys):
+            l1_result = self._l1.get(key)
+            if l1_result:
+                found[key] = l1_result["value"]
+            else:
+                missing.append(key)
+        self._stats["l1_hits"] += len(found)
+        
+        # L2 (Redis, or disk when Redis is out)
+        if missing:
+            lower_found = self._fetch_lower(missing)
+            self._stats["misses"] += len(missing) - len(lower_found)
+            found.update(lower_found)
+        
+        return found
+    
+    def _fetch_lower(self, keys: List[str]) -> Dict[str, Any]:
+        """Fetch L1 misses from Redis, or from the disk tier if Redis can't answer."""
+        found = self._fetch_l2(keys)
+        if found is not None:
+            self._stats["l2_hits"] += len(found)
+            return found
+        found = self._fetch_disk(keys)
+        self._stats["disk_hits"] += len(found)
+        return found
+    
+    def _fetch_disk(self, keys: List[str]) -> Dict[str, Any]:
+        """Fetch keys from the disk tier, promoting hits to L1."""
+        if self._disk is None:
+            return {}
+        fetch_started = time.time()
+        found: Dict[str, Any] = {}
+        for key, (payload, remaining) in self._disk.get_many(keys).items():
+            try:
+                value = self._codec.decode(payload)
+            except Exception:
+                continue
+            found[key] = value
+            if self._tombstones and self._invalidated_since(key, fetch_started):
+                self._stats["promotions_suppressed"] += 1
+                continue
+            self._l1.set(key, value, ttl=remaining)
+        return found
+    
+    def _fetch_l2(self, keys: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        Fetch keys and their remaining TTLs from Redis in one round trip,
+        promoting hits to L1. None when Redis is unavailable or the call failed.
+        """
+        if not self._redis_available:
+            return None
+        if not keys:
+            return {}
+        
+        fetch_started = time.time()
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            for key in keys:
+                pipe.get(key)
+                pipe.pttl(key)
+            replies = pipe.execute()
+            self._stats["l2_round_trips"] += 1
+        except Exception:
+            return None
+        
+        found: Dict[str, Any] = {}
+        for i, key in enumerate(keys):
+            payload, pttl = replies[2 * i], replies[2 * i + 1]
+            if payload is None:
+                continue
+            try:
+                value = self._codec.decode(payload)
+            except Exception:
+                continue
+            
+            # Promote to L1 for no longer than Redis will keep it, unless the key
+            # was invalidated while the read was in flight
+            found[key] = value
+            if self._tombstones and self._invalidated_since(key, fetch_started):
+                self._stats["promotions_suppressed"] += 1
+                continue
+            ttl = pttl / 1000 if pttl and pttl > 0 else self.config.default_ttl
+            self._l1.set(key, value, ttl=ttl)
+        
+        return found
+    
+    def set(self, key: str, value: Any, ttl: int = None, tags: Optional[Iterable[str]] = None):
+        """Set in multi-level cache, optionally tagged for invalidate_tags()."""
+        ttl = ttl or self.config.default_ttl
+        
+        # L1
+        if tags:
+            self._tag(key, tags)
+        self._l1.set(key, value, ttl=ttl)
+        
+        payload = None
+        if self._redis_available or self._disk is not None:
+            payload = self._encode_or_drop({key: value}).get(key)
+        if payload is not None:
+            # L2
+            if self._redis_available:
+                try:
+                    if tags:
+                        pipe = self._redis.pipeline(transaction=False)
+                        pipe.setex(key, ttl, payload)
+                        self._index_l2(pipe, key, tags, ttl)
+                        pipe.execute()
+                    else:
+                        self._redis.setex(key, ttl, payload)
+                    self._stats["l2_round_trips"] += 1
+                except Exception:
+                    pass
+            
+            # Disk
+            if self._disk is not None:
+                self._disk.set_many({key: payload}, ttl, {key: tags} if tags else None)
+        
+        self._stats["sets"] += 1
+    
+    def set_many(self, items: Dict[str, Any], ttl: int = None,
+                 tags: Optional[Dict[str, Iterable[str]]] = None):
+        """
+        Set many keys in multi-level cache with one pipelined Redis round trip.
+        tags optionally maps keys to their invalidation tags.
+        """
+        if not items:
+            return
+        ttl = ttl or self.config.default_ttl
+        tags = tags or {}
+        
+        # L1
+        for key, value in items.items():
+            if tags.get(key):
+                self._tag(key, tags[key])
+            self._l1.set(key, value, ttl=ttl)
+        
+        payloads = {}
+        if self._redis_available or self._disk is not None:
+            payloads = self._encode_or_drop(items)
+        if payloads:
+            # L2
+            if self._redis_available:
+                try:
+                    pipe = self._redis.pipeline(transaction=False)
+                    for key, payload in payloads.items():
+                        pipe.setex(key, ttl, payload)
+                        if tags.get(key):
+                            self._index_l2(pipe, key, tags[key], ttl)
+                    pipe.execute()
+                    self._stats["l2_round_trips"] += 1
+                except Exception:
+                    pass
+            
+            # Disk (one transaction)
+            if self._disk is not None:
+                self._disk.set_many(payloads, ttl, tags)
+        
+        self._stats["sets"] += len(items)
+    
+    def _encode_or_drop(self, items: Dict[str, Any]) -> Dict[str, bytes]:
+        """
+        Encode values for Redis/disk. Values the codec can't represent stay
+        in L1 only, and their keys are deleted from the lower tiers so an
+        older value there can't resurface after L1 eviction.
+        """
+        payloads: Dict[str, bytes] = {}
+        dropped: List[str] = []
+        for key, value in items.items():
+            try:
+                payloads[key] = self._codec.encode(value)
+            except (TypeError, ValueError, OverflowError) as e:
+                dropped.append(key)
+                logging.debug(f"Cache value for {key} not serializable, kept in L1 only: {e}")
+        if dropped:
+            self._stats["unserializable"] += len(dropped)
+            if self._disk is not None:
+                self._disk.delete_many(dropped)
+            if self._redis_available:
+                try:
+                    self._redis.delete(*dropped)
+                    self._stats["l2_round_trips"] += 1
+                except Exception:
+                    pass
+        return payloads
+    
+    @staticmethod
+    def _tag_key(tag: str) -> str:
+        return f"graphql:tag:{tag}"
+    
+    def _tag(self, key: str, tags: Iterable[str]):
+        """Record key under tags in the L1 index, replacing its previous tags."""
+        tags = frozenset(tags)
+        with self._tag_lock:
+            previous = self._key_tags.get(key)
+            if previous:
+                for tag in previous - tags:
+                    self._discard_tag(tag, key)
+            self._key_tags[key] = tags
+            for tag in tags:
+                self._tag_index[tag].add(key)
+        self._stats["tagged_sets"] += 1
+    
+    def _untag(self, key: str):
+        """L1 removal listener: drop key from the tag index."""
+        with self._tag_lock:
+            for tag in self._key_tags.pop(key, ()):
+                self._discard_tag(tag, key)
+    
+    def _discard_tag(self, tag: str, key: str):
+        """Caller holds _tag_lock."""
+        keys = self._tag_index.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tag_index[tag]
+    
+    def _index_l2(self, pipe, key: str, tags: Iterable[str], ttl: int):
+        """Queue SADDs of key into its Redis tag sets."""
+        for tag in tags:
+            tag_key = self._tag_key(tag)
+            pipe.sadd(tag_key, key)
+            pipe.expire(tag_key, max(ttl, self.config.tag_index_ttl))
+    
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """
+        Delete every entry tagged with any of tags from L1 and Redis.
+        Cost is proportional to the number of affected keys. Returns the
+        number of keys invalidated.
+        """
+        tags = list(dict.fromkeys(tags))
+        if not tags:
+            return 0
+        invalidated_at = time.time()
+        
+        # L1 index
+        keys: set = set()
+        with self._tag_lock:
+            for tag in tags:
+                keys.update(self._tag_index.get(tag, ()))
+        
+        # Disk index
+        if self._disk is not None:
+            keys.update(self._disk.keys_for_tags(tags))
+        
+        # Redis index (covers entries written by other replicas or promoted from L2)
+        if self._redis_available:
+            try:
+                pipe = self._redis.pipeline(transaction=False)
+                for tag in tags:
+                    pipe.smembers(self._tag_key(tag))
+                for members in pipe.execute():
+                    keys.update(m.decode() if isinstance(m, bytes) else m for m in members or ())
+                
+                pipe = self._redis.pipeline(transaction=False)
+                if keys:
+                    pipe.delete(*keys)
+                pipe.delete(*[self._tag_key(tag) for tag in tags])
+                pipe.execute()
+                self._stats["l2_round_trips"] += 2
+            except Exception as e:
+                logging.warning(f"Redis tag invalidation failed: {e}")
+        
+        self._tombstone(keys, invalidated_at)
+        for key in keys:
+            self._l1.delete(key)
+        if self._disk is not None and keys:
+            self._disk.delete_many(keys)
+        if self._bus is not None:
+            self._bus.publish(keys=keys, tags=tags)
+        
+        self._stats["invalidations"] += 1
+        self._stats["invalidated_keys"] += len(keys)
+        return len(keys)
+    
+    def delete(self, key: str) -> bool:
+        """Delete from all cache levels (and other replicas' L1 via the invalidation bus)."""
+        self._tombstone([key], time.time())
+        l1_deleted = self._l1.delete(key)
+        if self._disk is not None:
+            self._disk.delete_many([key])
+        if self._bus is not None:
+            self._bus.publish(keys=[key])
+        
+        if self._redis_available:
+            try:
+                self._redis.delete(key)
+                self._stats["l2_round_trips"] += 1
+            except Exception:
+                pass
+        
+        return l1_deleted
+    
+    def delete_many(self, keys: List[str]) -> int:
+        """Delete many keys from all cache levels. Returns number removed from L1."""
+        if not keys:
+            return 0
+        self._tombstone(keys, time.time())
+        l1_deleted = sum(1 for key in keys if self._l1.delete(key))
+        if self._disk is not None:
+            self._disk.delete_many(keys)
+        if self._bus is not None:
+            self._bus.publish(keys=keys)
+        
+        if self._redis_available:
+            try:
+                self._redis.delete(*keys)
+                self._stats["l2_round_trips"] += 1
+            except Exception:
+                pass
+        
+        return l1_deleted
+    
+    TOMBSTONE_SECONDS = 10  # Longer than any L2 read can be in flight
+    
+    def _tombstone(self, keys: Iterable[str], invalidated_at: float):
+        """Record invalidation times, dropping tombstones older than TOMBSTONE_SECONDS."""
+        with self._tombstone_lock:
+            tombstones = self._tombstones
+            for key in keys:
+                if tombstones.get(key, 0.0) < invalidated_at:
+                    tombstones[key] = invalidated_at
+                    tombstones.move_to_end(key)
+            cutoff = time.time() - self.TOMBSTONE_SECONDS
+            while tombstones and next(iter(tombstones.values())) < cutoff:
+                tombstones.popitem(last=False)
+    
+    def _invalidated_since(self, key: str, since: float) -> bool:
+        return self._tombstones.get(key, 0.0) >= since
+    
+    def attach_invalidation_bus(self, transport: "InvalidationTransport", **kwargs) -> "InvalidationBus":
+        """Broadcast deletes/tag invalidations over transport and apply other replicas' ones to L1."""
+        if self._bus is not None:
+            self._bus.close()
+        self._bus = InvalidationBus(
+            self, transport,
+            batch_ms=kwargs.pop("batch_ms", self.config.invalidation_batch_ms),
+            max_batch=kwargs.pop("max_batch", self.config.invalidation_max_batch),
+            **kwargs
+        )
+        return self._bus
+    
+    def apply_remote_invalidation(self, keys: Iterable[str], tags: Iterable[str], version: float) -> int:
+        """
+        Drop L1 entries invalidated by another replica at wall-clock time
+        version. Entries written locally after that are kept, so a late
+        message can't evict newer data; keys are tombstoned so an in-flight
+        L2 read can't resurrect the old value. Returns entries removed.
+        """
+        keys = set(keys)
+        tags = list(tags)
+        if tags:
+            with self._tag_lock:
+                for tag in tags:
+                    keys.update(self._tag_index.get(tag, ()))
+            if self._disk is not None:
+                keys.update(self._disk.keys_for_tags(tags))
+        if not keys:
+            return 0
+        
+        self._tombstone(keys, version)
+        if self._disk is not None:
+            self._disk.delete_many(keys)
+        removed = 0
+        for key in keys:
+            entry = self._l1.peek(key)
+            if entry is not None and entry["created"].timestamp() <= version and self._l1.delete(key):
+                removed += 1
+        return removed
+    
+    def close(self):
+        """Flush and stop the invalidation bus, close the disk tier."""
+        if self._bus is not None:
+            self._bus.close()
+            self._bus = None
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+    
+    def get_stats(self) -> Dict:
+        """Get cache statistics."""
+        total = self._stats["l1_hits"] + self._stats["l2_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+        l1_stats = self._l1.get_stats()
         return {
             "l1_hits": self._stats["l1_hits"],
             "l2_hits": self._stats["l2_hits"],
+            "disk_hits": self._stats["disk_hits"],
             "misses": self._stats["misses"],
-            "l1_size": self._l1.size(),
+            "l1_policy": l1_stats["policy"],
+            "l1_size": l1_stats["size"],
+            "l1_bytes": l1_stats["bytes"],
+            "l1_evictions": l1_stats["evictions"],
+            "l1_expirations": l1_stats["expirations"],
             "total_requests": total,
+            "l2_round_trips": self._stats["l2_round_trips"],
+            "l2_codec": self._codec.describe(),
+            "tags": len(self._tag_index),
+            "tagged_sets": self._stats["tagged_sets"],
+            "invalidations": self._stats["invalidations"],
+            "invalidated_keys": self._stats["invalidated_keys"],
+            "promotions_suppressed": self._stats["promotions_suppressed"],
+            "unserializable": self._stats["unserializable"],
+            "invalidation_bus": self._bus.get_stats() if self._bus is not None else None,
+            "disk": self._disk.get_stats() if self._disk is not None else None,
             "overall_hit_rate": f"{(total - self._stats['misses']) / total * 100:.1f}%" if total > 0 else "N/A"
         }
 
+# ============================================
+# CACHE INVALIDATION BUS
+# ============================================
+
+class InvalidationTransport(ABC):
+    """Broadcast channel shared by all replicas."""
+    
+    @abstractmethod
+    def publish(self, payload: bytes):
+        """Send payload to every subscriber (including, possibly, the sender)."""
+    
+    @abstractmethod
+    def subscribe(self, callback: Callable[[bytes], None]):
+        """Deliver received payloads to callback."""
+    
+    def close(self):
+        pass
+
+class RedisPubSubTransport(InvalidationTransport):
+    """Redis pub/sub channel; messages are received on a background thread."""
+    
+    def __init__(self, redis_client, channel: str):
+        self._redis = redis_client
+        self.channel = channel
+        self._pubsub = None
+        self._thread = None
+    
+    def publish(self, payload: bytes):
+        self._redis.publish(self.channel, payload)
+    
+    def subscribe(self, callback: Callable[[bytes], None]):
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self.channel: lambda message: callback(message["data"])})
+        self._thread = self._pubsub.run_in_thread(sleep_time=0.1, daemon=True)
+    
+    def close(self):
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
+        if self._pubsub is not None:
+            self._pubsub.close()
+            self._pubsub = None
+
+class InProcessTransport(InvalidationTransport):
+    """
+    In-process stand-in for pub/sub: every cache attached to the same
+    instance receives every message, synchronously.
+    """
+    
+    def __init__(self):
+        self._subscribers: List[Callable[[bytes], None]] = []
+        self._lock = threading.Lock()
+    
+    def publish(self, payload: bytes):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(payload)
+    
+    def subscribe(self, callback: Callable[[bytes], None]):
+        with self._lock:
+            self._subscribers.append(callback)
+
+class InvalidationBus:
+    """
+    Batches a cache's invalidations into messages
+    {"origin", "seq", "version", "keys", "tags"} and applies messages from
+    other origins to the cache's L1. version is the sender's wall clock at
+    flush time, so receivers keep entries written after it. Invalidations
+    are idempotent, so every message is applied even if it arrives out of
+    order or twice; seq only feeds the messages_out_of_order count.
+    """
+    
+    def __init__(self, cache: "MultiLevelCache", transport: InvalidationTransport,
+                 batch_ms: int = 10, max_batch: int = 500, node_id: Optional[str] = None):
+        self.cache = cache
+        self.transport = transport
+        self.node_id = node_id or f"{os.getpid()}-{os.urandom(4).hex()}"
+        self.batch_ms = batch_ms
+        self.max_batch = max_batch
+        
+        self._pending_keys: Dict[str, None] = {}
+        self._pending_tags: Dict[str, None] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._seq = 0
+        self._last_seq: Dict[str, int] = {}
+        self._running = True
+        
+        self._stats = {
+            "messages_sent": 0,
+            "messages_received": 0,
+            "messages_out_of_order": 0,  # seq not above the origin's last (reordered or redelivered)
+            "keys_sent": 0,
+            "tags_sent": 0,
+            "entries_invalidated": 0,
+            "publish_errors": 0
+        }
+        
+        transport.subscribe(self._on_message)
+        self._thread = threading.Thread(target=self._flush_loop, name="cache-invalidation", daemon=True)
+        self._thread.start()
+    
+    def publish(self, keys: Iterable[str] = (), tags: Iterable[str] = ()):
+        """Queue invalidations; sent within batch_ms, or at once when the batch is full."""
+        with self._lock:
+            self._pending_keys.update(dict.fromkeys(keys))
+            self._pending_tags.update(dict.fromkeys(tags))
+            full = len(self._pending_keys) + len(self._pending_tags) >= self.max_batch
+        if full or self.batch_ms <= 0:
+            self.flush()
+        else:
+            self._wakeup.set()
+    
+    def flush(self):
+        """Send everything queued, in messages of at most max_batch items."""
+        while True:
+            with self._lock:
+                if not self._pending_keys and not self._pending_tags:
+                    return
+                keys = list(itertools.islice(self._pending_keys, self.max_batch))
+                for key in keys:
+                    del self._pending_keys[key]
+                tags = list(itertools.islice(self._pending_tags, self.max_batch - len(keys)))
+                for tag in tags:
+                    del self._pending_tags[tag]
+                self._seq += 1
+                seq = self._seq
+            
+            message = {
+                "origin": self.node_id,
+                "seq": seq,
+                "version": time.time(),
+                "keys": keys,
+                "tags": tags
+            }
+            try:
+                self.transport.publish(json.dumps(message).encode())
+                self._stats["messages_sent"] += 1
+                self._stats["keys_sent"] += len(keys)
+                self._stats["tags_sent"] += len(tags)
+            except Exception as e:
+                self._stats["publish_errors"] += 1
+                logging.warning(f"Invalidation publish failed: {e}")
+    
+    def _flush_loop(self):
+        while self._running:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._running:
+                break
+            time.sleep(self.batch_ms / 1000)  # Let the batch fill
+            self.flush()
+    
+    def _on_message(self, payload: bytes):
+        try:
+            message = json.loads(payload)
+            origin = message["origin"]
+            if origin == self.node_id:
+                return
+            last = self._last_seq.get(origin, 0)
+            if message["seq"] <= last:
+                self._stats["messages_out_of_order"] += 1
+            self._last_seq[origin] = max(last, message["seq"])
+            self._stats["messages_received"] += 1
+            self._stats["entries_invalidated"] += self.cache.apply_remote_invalidation(
+                message.get("keys", ()), message.get("tags", ()), message["version"]
+            )
+        except Exception as e:
+            logging.warning(f"Bad invalidation message: {e}")
+    
+    def close(self):
+        self.flush()
+        self._running = False
+        self._wakeup.set()
+        self.transport.close()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {"node_id": self.node_id, **self._stats}
+
+# ============================================
+# GRAPHQL PARSER
+# ============================================
+
+class GraphQLSyntaxError(ValueError):
+    """Raised when a GraphQL document can't be tokenized or parsed."""
+    pass
+
+@dataclass(frozen=True)
+class GraphQLVariable:
+    """Reference to an operation variable ($name) in an argument value."""
+    name: str
+
+class GraphQLEnumValue(str):
+    """Enum literal (unquoted name) in an argument value."""
+    pass
+
+@dataclass
+class GraphQLField:
+    name: str
+    alias: Optional[str] = None
+    arguments: Dict[str, Any] = field(default_factory=dict)
+    directives: List[tuple] = field(default_factory=list)
+    selections: List[Any] = field(default_factory=list)
+
+@dataclass
+class GraphQLFragmentSpread:
+    name: str
+    directives: List[tuple] = field(default_factory=list)
+
+@dataclass
+class GraphQLInlineFragment:
+    type_condition: Optional[str]
+    directives: List[tuple] = field(default_factory=list)
+    selections: List[Any] = field(default_factory=list)
+
+@dataclass
+class GraphQLOperation:
+    operation: str  # query, mutation, subscription
+    name: Optional[str]
+    variables: Dict[str, tuple] = field(default_factory=dict)  # name -> (type, default)
+    directives: List[tuple] = field(default_factory=list)
+    selections: List[Any] = field(default_factory=list)
+
+@dataclass
+class GraphQLFragment:
+    name: str
+    type_condition: str
+    directives: List[tuple] = field(default_factory=list)
+    selections: List[Any] = field(default_factory=list)
+
+@dataclass
+class GraphQLDocument:
+    operations: List[GraphQLOperation]
+    fragments: Dict[str, GraphQLFragment]
+    normalized: str  # Minified token stream (no whitespace/comments)
+    signature: str   # Hash of normalized text
+    canonical: str = ""    # Minified with sorted arguments/selections (see _Canonicalizer)
+    fingerprint: str = ""  # Hash of canonical text; equal for equivalent formattings
+
+class GraphQLParser:
+    """
+    Single-pass tokenizer and recursive-descent parser for executable
+    GraphQL documents. Strings, block strings and comments are tokenized
+    properly, so braces inside them don't affect structure.
+    """
+    
+    _TOKEN_RE = re.compile(r'''
+        (?P<skip>[\s,\ufeff]+|\#[^\n\r]*)
+      | (?P<block_string>"""(?:\\"""|[^"]|"(?!""))*""")
+      | (?P<string>"(?:\\.|[^"\\\n\r])*")
+      | (?P<spread>\.\.\.)
+      | (?P<punct>[!$&()\:=@\[\]{}|])
+      | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+      | (?P<name>[_A-Za-z][_0-9A-Za-z]*)
+    ''', re.VERBOSE)
+    
+    def __init__(self, text: str):
+        self._text = text
+        self._tokens = self._tokenize(text)
+        self._pos = 0
+    
+    @classmethod
+    def parse(cls, text: str) -> GraphQLDocument:
+        """Parse a document."""
+        return cls(text)._parse_document()
+    
+    def _tokenize(self, text: str) -> List[tuple]:
+        tokens = []
+        pos, end = 0, len(text)
+        match = self._TOKEN_RE.match
+        while pos < end:
+            m = match(text, pos)
+            if m is None:
+                raise GraphQLSyntaxError(f"Unexpected character {text[pos]!r} at offset {pos}")
+            kind = m.lastgroup
+            if kind != "skip":
+                tokens.append((kind, m.group(), pos))
+            pos = m.end()
+        tokens.append(("eof", "", end))
+        return tokens
+    
+    def _normalized(self) -> str:
+        parts = []
+        previous_word = False
+        for kind, value, _ in self._tokens:
+            word = kind in ("name", "number")
+            if word and previous_word:
+                parts.append(" ")
+            parts.append(value)
+            previous_word = word
+        return "".join(parts)
+    
+    # Token helpers
+    
+    def _peek(self, value: str = None) -> bool:
+        token = self._tokens[self._pos]
+        return token[0] != "eof" and (value is None or (token[1] == value and token[0] != "string"))
+    
+    def _next(self) -> tuple:
+        token = self._tokens[self._pos]
+        self._pos += 1
+        return token
+    
+    def _expect(self, value: str) -> tuple:
+        token = self._next()
+        if token[1] != value or token[0] in ("string", "block_string"):
+            raise GraphQLSyntaxError(f"Expected {value!r} at offset {token[2]}, got {token[1] or 'end of document'!r}")
+        return token
+    
+    def _expect_name(self) -> str:
+        token = self._next()
+        if token[0] != "name":
+            raise GraphQLSyntaxError(f"Expected name at offset {token[2]}, got {token[1] or 'end of document'!r}")
+        return token[1]
+    
+    # Grammar
+    
+    def _parse_document(self) -> GraphQLDocument:
+        operations: List[GraphQLOperation] = []
+        fragments: Dict[str, GraphQLFragment] = {}
+        
+        while self._tokens[self._pos][0] != "eof":
+            if self._peek("{"):
+                operations.append(GraphQLOperation("query", None, selections=self._parse_selection_set()))
+            elif self._peek("fragment"):
+                fragment = self._parse_fragment()
+                fragments[fragment.name] = fragment
+            elif self._peek("query") or self._peek("mutation") or self._peek("subscription"):
+                operations.append(self._parse_operation())
+            else:
+                token = self._tokens[self._pos]
+                raise GraphQLSyntaxError(f"Unexpected {token[1]!r} at offset {token[2]}")
+        
+        if not operations:
+            raise GraphQLSyntaxError("Document contains no operations")
+        
+        normalized = self._normalized()
+        canonical = _Canonicalizer.document(operations, fragments)
+        return GraphQLDocument(
+            operations=operations,
+            fragments=fragments,
+            normalized=normalized,
+            signature=hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest(),
+            canonical=canonical,
+            fingerprint=hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+        )
+    
+    def _parse_operation(self) -> GraphQLOperation:
+        operation = self._expect_name()
+        name = self._expect_name() if self._tokens[self._pos][0] == "name" else None
+        variables: Dict[str, tuple] = {}
+        if self._peek("("):
+            self._next()
+            while not self._peek(")"):
+                self._expect("$")
+                var_name = self._expect_name()
+                self._expect(":")
+                var_type = self._parse_type()
+                default = None
+                if self._peek("="):
+                    self._next()
+                    default = self._parse_value(const=True)
+                self._parse_directives()
+                variables[var_name] = (var_type, default)
+            self._expect(")")
+        directives = self._parse_directives()
+        return GraphQLOperation(operation, name, variables, directives, self._parse_selection_set())
+    
+    def _parse_fragment(self) -> GraphQLFragment:
+        self._expect("fragment")
+        name = self._expect_name()
+        self._expect("on")
+        type_condition = self._expect_name()
+        directives = self._parse_directives()
+        return GraphQLFragment(name, type_condition, directives, self._parse_selection_set())
+    
+    def _parse_type(self) -> str:
+        if self._peek("["):
+            self._next()
+            inner = self._parse_type()
+            self._expect("]")
+            type_str = f"[{inner}]"
+        else:
+            type_str = self._expect_name()
+        if self._peek("!"):
+            self._next()
+            type_str += "!"
+        return type_str
+    
+    def _parse_selection_set(self) -> List[Any]:
+        self._expect("{")
+        selections = []
+        while not self._peek("}"):
+            if not self._peek():
+                raise GraphQLSyntaxError("Unterminated selection set")
+            selections.append(self._parse_selection())
+        self._expect("}")
+        if not selections:
+            raise GraphQLSyntaxError("Empty selection set")
+        return selections
+    
+    def _parse_selection(self) -> Any:
+        if self._peek("..."):
+            self._next()
+            if self._tokens[self._pos][0] == "name" and not self._peek("on"):
+                name = self._expect_name()
+                return GraphQLFragmentSpread(name, self._parse_directives())
+            type_condition = None
+            if self._peek("on"):
+                self._next()
+                type_condition = self._expect_name()
+            directives = self._parse_directives()
+            return GraphQLInlineFragment(type_condition, directives, self._parse_selection_set())
+        
+        name = self._expect_name()
+        alias = None
+        if self._peek(":"):
+            self._next()
+            alias, name = name, self._expect_name()
+        arguments = self._parse_arguments()
+        directives = self._parse_directives()
+        selections = self._parse_selection_set() if self._peek("{") else []
+        return GraphQLField(name, alias, arguments, directives, selections)
+    
+    def _parse_arguments(self, const: bool = False) -> Dict[str, Any]:
+        arguments: Dict[str, Any] = {}
+        if self._peek("("):
+            self._next()
+            while not self._peek(")"):
+                arg_name = self._expect_name()
+                self._expect(":")
+                arguments[arg_name] = self._parse_value(const)
+            self._expect(")")
+        return arguments
+    
+    def _parse_directives(self) -> List[tuple]:
+        directives = []
+        while self._peek("@"):
+            self._next()
+            directives.append((self._expect_name(), self._parse_arguments()))
+        return directives
+    
+    def _parse_value(self, const: bool = False) -> Any:
+        kind, value, offset = self._next()
+        if kind == "punct":
+            if value == "$" and not const:
+                return GraphQLVariable(self._expect_name())
+            if value == "[":
+                items = []
+                while not self._peek("]"):
+                    items.append(self._parse_value(const))
+                self._expect("]")
+                return items
+            if value == "{":
+                fields = {}
+                while not self._peek("}"):
+                    field_name = self._expect_name()
+                    self._expect(":")
+                    fields[field_name] = self._parse_value(const)
+                self._expect("}")
+                return fields
+        elif kind == "number":
+            return float(value) if any(c in value for c in ".eE") else int(value)
+        elif kind == "string":
+            try:
+                return json.loads(value)
+            except ValueError:
+                raise GraphQLSyntaxError(f"Invalid string at offset {offset}")
+        elif kind == "block_string":
+            return value[3:-3].replace('\\"""', '"""')
+        elif kind == "name":
+            if value == "true":
+                return True
+            if value == "false":
+                return False
+            if value == "null":
+                return None
+            return GraphQLEnumValue(value)
+        raise GraphQLSyntaxError(f"Unexpected {value or 'end of document'!r} at offset {offset}")
+
+class _Canonicalizer:
+    """
+    Prints a parsed document in canonical form: minified, arguments,
+    object fields, directives, variable definitions and selections sorted,
+    fragments sorted by name, and the operation name dropped when there is
+    only one operation. Documents that differ only in formatting, comments
+    or field/argument order print identically.
+    """
+    
+    @classmethod
+    def document(cls, operations: List[GraphQLOperation], fragments: Dict[str, GraphQLFragment]) -> str:
+        parts = [cls.operation(op, named=len(operations) > 1) for op in operations]
+        if len(operations) > 1:
+            parts.sort()
+        for name in sorted(fragments):
+            fragment = fragments[name]
+            parts.append(f"fragment {name} on {fragment.type_condition}"
+                         f"{cls.directives(fragment.directives)}{cls.selections(fragment.selections)}")
+        return " ".join(parts)
+    
+    @classmethod
+    def operation(cls, op: GraphQLOperation, named: bool) -> str:
+        head = op.operation
+        if named and op.name:
+            head += f" {op.name}"
+        if op.variables:
+            definitions = []
+            for name in sorted(op.variables):
+                var_type, default = op.variables[name]
+                definition = f"${name}:{var_type}"
+                if default is not None:
+                    definition += f"={cls.value(default)}"
+                definitions.append(definition)
+            head += f"({','.join(definitions)})"
+        return f"{head}{cls.directives(op.directives)}{cls.selections(op.selections)}"
+    
+    @classmethod
+    def selections(cls, selections: List[Any]) -> str:
+        if not selections:
+            return ""
+        return "{" + " ".join(sorted(cls.selection(s) for s in selections)) + "}"
+    
+    @classmethod
+    def selection(cls, selection: Any) -> str:
+        if isinstance(selection, GraphQLField):
+            alias = f"{selection.alias}:" if selection.alias and selection.alias != selection.name else ""
+            return (f"{alias}{selection.name}{cls.arguments(selection.arguments)}"
+                    f"{cls.directives(selection.directives)}{cls.selections(selection.selections)}")
+        if isinstance(selection, GraphQLFragmentSpread):
+            return f"...{selection.name}{cls.directives(selection.directives)}"
+        condition = f"on {selection.type_condition}" if selection.type_condition else ""
+        return f"...{condition}{cls.directives(selection.directives)}{cls.selections(selection.selections)}"
+    
+    @classmethod
+    def arguments(cls, arguments: Dict[str, Any]) -> str:
+        if not arguments:
+            return ""
+        return "(" + ",".join(f"{name}:{cls.value(arguments[name])}" for name in sorted(arguments)) + ")"
+    
+    @classmethod
+    def directives(cls, directives: List[tuple]) -> str:
+        return "".join(sorted(f"@{name}{cls.arguments(arguments)}" for name, arguments in directives))
+    
+    @classmethod
+    def value(cls, value: Any) -> str:
+        if isinstance(value, GraphQLVariable):
+            return f"${value.name}"
+        if isinstance(value, GraphQLEnumValue):
+            return str(value)
+        if value is None:
+            return "null"
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        if isinstance(value, (int, float)):
+            return repr(value)
+        if isinstance(value, str):
+            return json.dumps(value)
+        if isinstance(value, list):
+            return "[" + ",".join(cls.value(v) for v in value) + "]"
+        return "{" + ",".join(f"{k}:{cls.value(value[k])}" for k in sorted(value)) + "}"
+
 # ============================================
 # QUERY ANALYZER
 # ============================================
 
 class QueryComplexityAnalyzer:
-    """Analyzes GraphQL query complexity."""
+    """
+    Analyzes GraphQL query complexity.
+    Depth and a field-weighted cost are computed from the parsed document:
+    leaf fields cost SCALAR, object fields OBJECT (CONNECTION for
+    edges/nodes), and fields with a first/last/limit argument cost LIST
+    plus their object children multiplied by that page size; their scalar
+    children come from the same rows and are counted once. Fragments are
+    expanded. Parsed documents are memoized by raw text and analyses by
+    the document fingerprint.
+    """
     
     DEFAULT_COSTS = {
         "FIELD": 1,
@@ -434,45 +2691,151 @@ class QueryComplexityAnalyzer:
         QueryComplexity.CRITICAL: 12
     }
     
-    def __init__(self, max_depth: int = 7, max_complexity: int = 100):
+    PAGINATION_ARGS = ("first", "last", "limit")
+    CONNECTION_FIELDS = ("edges", "nodes")
+    DEFAULT_PAGE_SIZE = 10
+    
+    def __init__(self, max_depth: int = 7, max_complexity: int = 100, cache_size: int = 1000):
         self.max_depth = max_depth
         self.max_complexity = max_complexity
+        
+        # Memoization: raw text -> document, fingerprint (+ page-size variables) -> analysis
+        self._documents = LRUCache(max_size=cache_size)
+        self._analyses = LRUCache(max_size=cache_size)
+        self._stats = {
+            "parses": 0,
+            "document_cache_hits": 0,
+            "analysis_cache_hits": 0,
+            "syntax_errors": 0
+        }
+    
+    def parse(self, query: str) -> GraphQLDocument:
+        """Parse query, memoized by raw text. Raises GraphQLSyntaxError."""
+        return self._parse_entry(query)[0]
+    
+    def _parse_entry(self, query: str) -> tuple:
+        """(document, page-size variable names), memoized by raw text."""
+        entry = self._documents.get(query)
+        if entry is not None:
+            self._stats["document_cache_hits"] += 1
+            return entry["value"]
+        
+        self._stats["parses"] += 1
+        try:
+            document = GraphQLParser.parse(query)
+        except GraphQLSyntaxError:
+            self._stats["syntax_errors"] += 1
+            raise
+        parsed = (document, self._page_size_variables(document))
+        self._documents.set(query, parsed)
+        return parsed
     
     def analyze(self, query: str, variables: Dict = None) -> Dict:
         """Analyze query complexity and depth."""
+        try:
+            document, page_vars = self._parse_entry(query)
+        except GraphQLSyntaxError as e:
+            return {
+                "depth": 0,
+                "complexity": 0,
+                "level": QueryComplexity.LOW.value,
+                "is_valid": False,
+                "warnings": [f"Syntax error: {e}"],
+                "recommendations": []
+            }
+        
+        return self.analyze_parsed(document, page_vars, variables)
+    
+    def analyze_parsed(self, document: GraphQLDocument, page_vars: set,
+                       variables: Dict = None) -> Dict:
+        """Analyze an already-parsed document (page_vars: variables feeding first/last/limit)."""
+        variables = variables or {}
+        cache_key = document.fingerprint
+        if page_vars:
+            cache_key += json.dumps({name: variables.get(name) for name in sorted(page_vars)},
+                                    sort_keys=True, default=str)
+        
+        entry = self._analyses.get(cache_key)
+        if entry is not None:
+            self._stats["analysis_cache_hits"] += 1
+            analysis = entry["value"]
+        else:
+            analysis = self._analyze_document(document, variables)
+            self._analyses.set(cache_key, analysis)
+        
         return {
-            "depth": self._calculate_depth(query),
-            "complexity": self._calculate_complexity(query),
-            "is_valid": True,
-            "warnings": [],
-            "recommendations": []
+            **analysis,
+            "warnings": list(analysis["warnings"]),
+            "recommendations": list(analysis["recommendations"])
         }
     
-    def _calculate_depth(self, query: str) -> int:
-        """Calculate maximum nesting depth."""
+    def _analyze_document(self, document: GraphQLDocument, variables: Dict) -> Dict:
+        warnings: List[str] = []
+        recommendations: List[str] = []
         depth = 0
-        max_depth = 0
+        complexity = 0
+        
+        for operation in document.operations:
+            defaults = {name: default for name, (_, default) in operation.variables.items()}
+            walker = _CostWalker(self, document, {**defaults, **variables}, warnings)
+            cost, height = walker.walk(operation.selections)
+            depth = max(depth, height)
+            complexity = max(complexity, cost)
         
-        for char in query:
-            if char == '{':
-                depth += 1
-                max_depth = max(max_depth, depth)
-            elif char == '}':
-                depth -= 1
+        if depth > self.max_depth:
+            recommendations.append("Split deeply nested selections into separate queries")
+        if complexity > self.max_complexity:
+            recommendations.append("Lower first/limit page sizes or paginate nested lists")
         
-        return max_depth
+        return {
+            "depth": depth,
+            "complexity": complexity,
+            "level": self.classify(complexity).value,
+            "is_valid": not any(w.startswith("Unknown fragment") or w.startswith("Fragment cycle")
+                                for w in warnings),
+            "warnings": warnings,
+            "recommendations": recommendations
+        }
+    
+    def _page_size_variables(self, document: GraphQLDocument) -> set:
+        """Variables that feed first/last/limit arguments (they change the cost)."""
+        names: set = set()
+        
+        def visit(selections):
+            for selection in selections:
+                if isinstance(selection, GraphQLField):
+                    for arg in self.PAGINATION_ARGS:
+                        value = selection.arguments.get(arg)
+                        if isinstance(value, GraphQLVariable):
+                            names.add(value.name)
+                if not isinstance(selection, GraphQLFragmentSpread):
+                    visit(selection.selections)
+        
+        for operation in document.operations:
+            visit(operation.selections)
+        for fragment in document.fragments.values():
+            visit(fragment.selections)
+        return names
     
-    def _calculate_complexity(self, query: str) -> int:
-        """Estimate query complexity score."""
-        # Simplified complexity calculation
-        complexity = query.count('{') * 2
-        complexity += query.count('query') * 10
-        complexity += query.count('fragment') * 5
-        return complexity
+    @staticmethod
+    def classify(complexity: int) -> QueryComplexity:
+        """Map a complexity score to its QueryComplexity level."""
+        if complexity < 10:
+            return QueryComplexity.LOW
+        if complexity <= 50:
+            return QueryComplexity.MEDIUM
+        if complexity <= 100:
+            return QueryComplexity.HIGH
+        return QueryComplexity.CRITICAL
     
     def should_allow(self, query: str, variables: Dict = None) -> tuple[bool, str]:
         """Determine if query should be allowed."""
-        analysis = self.analyze(query, variables)
+        return self.verdict(self.analyze(query, variables))
+    
+    def verdict(self, analysis: Dict) -> tuple[bool, str]:
+        """Apply depth/complexity limits to an analysis."""
+        if not analysis["is_valid"]:
+            return False, "; ".join(analysis["warnings"]) or "Invalid query"
         
         if analysis["depth"] > self.max_depth:
             return False, f"Query depth {analysis['depth']} exceeds limit {self.max_depth}"
@@ -481,21 +2844,691 @@ class QueryComplexityAnalyzer:
             return False, f"Query complexity {analysis['complexity']} exceeds limit {self.max_complexity}"
         
         return True, "Query allowed"
+    
+    def get_stats(self) -> Dict:
+        """Get analyzer statistics."""
+        return {
+            **self._stats,
+            "documents_cached": self._documents.size(),
+            "analyses_cached": self._analyses.size()
+        }
+
+class _CostWalker:
+    """Computes (cost, depth) of a selection set, expanding fragments once each."""
+    
+    def __init__(self, analyzer: QueryComplexityAnalyzer, document: GraphQLDocument,
+                 variables: Dict, warnings: List[str]):
+        self._analyzer = analyzer
+        self._costs = analyzer.DEFAULT_COSTS
+        self._document = document
+        self._variables = variables
+        self._warnings = warnings
+        self._fragments: Dict[str, tuple] = {}
+        self._visiting: set = set()
+    
+    def walk(self, selections: List[Any]) -> tuple[int, int]:
+        cost, height = 0, 0
+        for selection in selections:
+            if isinstance(selection, GraphQLField):
+                if selection.name.startswith("__"):
+                    height = max(height, 1)
+                    continue
+                if not selection.selections:
+                    cost += self._costs["SCALAR"]
+                    height = max(height, 1)
+                    continue
+                child_cost, child_height = self.walk(selection.selections)
+                page_size = self._page_size(selection)
+                if page_size is not None:
+                    leaf_cost = self._leaf_cost(selection.selections)
+                    cost += self._costs["LIST"] + leaf_cost + page_size * (child_cost - leaf_cost)
+                elif selection.name in self._analyzer.CONNECTION_FIELDS:
+                    cost += self._costs["CONNECTION"] + child_cost
+                else:
+                    cost += self._costs["OBJECT"] + child_cost
+                height = max(height, 1 + child_height)
+            elif isinstance(selection, GraphQLInlineFragment):
+                child_cost, child_height = self.walk(selection.selections)
+                cost += child_cost
+                height = max(height, child_height)
+            else:
+                child_cost, child_height = self._spread(selection.name)
+                cost += child_cost
+                height = max(height, child_height)
+        return cost, height
+    
+    def _leaf_cost(self, selections: List[Any], visiting: frozenset = frozenset()) -> int:
+        """Cost of the scalar fields directly in a selection set (through fragments)."""
+        cost = 0
+        for selection in selections:
+            if isinstance(selection, GraphQLField):
+                if not selection.selections and not selection.name.startswith("__"):
+                    cost += self._costs["SCALAR"]
+            elif isinstance(selection, GraphQLInlineFragment):
+                cost += self._leaf_cost(selection.selections, visiting)
+            else:
+                fragment = self._document.fragments.get(selection.name)
+                if fragment is not None and selection.name not in visiting:
+                    cost += self._leaf_cost(fragment.selections, visiting | {selection.name})
+        return cost
+    
+    def _spread(self, name: str) -> tuple[int, int]:
+        if name in self._fragments:
+            return self._fragments[name]
+        fragment = self._document.fragments.get(name)
+        if fragment is None:
+            self._warnings.append(f"Unknown fragment {name}")
+            return 0, 0
+        if name in self._visiting:
+            self._warnings.append(f"Fragment cycle through {name}")
+            return 0, 0
+        self._visiting.add(name)
+        result = self.walk(fragment.selections)
+        self._visiting.discard(name)
+        self._fragments[name] = result
+        return result
+    
+    def _page_size(self, selection: GraphQLField) -> Optional[int]:
+        for arg in self._analyzer.PAGINATION_ARGS:
+            if arg not in selection.arguments:
+                continue
+            value = selection.arguments[arg]
+            if isinstance(value, GraphQLVariable):
+                value = self._variables.get(value.name)
+                if value is None:
+                    self._warnings.append(
+                        f"${arg} for {selection.name} not provided, assuming {self._analyzer.DEFAULT_PAGE_SIZE}"
+                    )
+                    return self._analyzer.DEFAULT_PAGE_SIZE
+            try:
+                return max(0, int(value))
+            except (TypeError, ValueError):
+                return self._analyzer.DEFAULT_PAGE_SIZE
+        return None
+
+# ============================================
+# PERSISTED QUERIES
+# ============================================
+
+class PersistedQueryError(Exception):
+    """Persisted query lookup/registration failure; code follows the APQ protocol."""
+    
+    def __init__(self, message: str, code: str):
+        super().__init__(message)
+        self.code = code
+
+@dataclass
+class PersistedQuery:
+    """A registered operation, parsed once."""
+    sha256: str
+    query: str
+    document: GraphQLDocument
+    page_vars: set
+
+class PersistedQueryRegistry:
+    """
+    Automatic persisted queries: sha256 -> parsed operation.
+    Query text is shared across replicas through MultiLevelCache; parsed
+    operations are kept in a local LRU so hits skip hashing and parsing.
+    In allowlist mode only operations loaded via register(..., pinned=True)
+    or load_manifest() may run.
+    """
+    
+    KEY_PREFIX = "graphql:apq:"
+    
+    def __init__(self, cache: MultiLevelCache, analyzer: QueryComplexityAnalyzer,
+                 allowlist_only: bool = False, ttl: int = 86400, local_size: int = 1000):
+        self._cache = cache
+        self._analyzer = analyzer
+        self.allowlist_only = allowlist_only
+        self._ttl = ttl
+        self._local = LRUCache(max_size=local_size)
+        self._pinned: Dict[str, PersistedQuery] = {}
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "registered": 0,
+            "rejected": 0
+        }
+    
+    @staticmethod
+    def hash_query(query: str) -> str:
+        return hashlib.sha256(query.encode("utf-8")).hexdigest()
+    
+    def register(self, query: str, sha256_hash: str = None, pinned: bool = False) -> PersistedQuery:
+        """Verify, parse and store an operation. Raises PersistedQueryError or GraphQLSyntaxError."""
+        actual = self.hash_query(query)
+        if sha256_hash is not None and sha256_hash.lower() != actual:
+            self._stats["rejected"] += 1
+            raise PersistedQueryError("provided sha does not match query", "PERSISTED_QUERY_HASH_MISMATCH")
+        
+        entry = self._build(actual, query)
+        if pinned:
+            self._pinned[actual] = entry
+        else:
+            self._cache.set(self.KEY_PREFIX + actual, query, ttl=self._ttl)
+            self._local.set(actual, entry, ttl=self._ttl)
+        self._stats["registered"] += 1
+        return entry
+    
+    def load_manifest(self, manifest: Dict[str, str]):
+        """Pin a {sha256: query} manifest (e.g. generated at client build time)."""
+        for sha256_hash, query in manifest.items():
+            self.register(query, sha256_hash, pinned=True)
+    
+    def lookup(self, sha256_hash: str) -> Optional[PersistedQuery]:
+        """Find a registered operation by hash."""
+        sha256_hash = sha256_hash.lower()
+        entry = self._pinned.get(sha256_hash)
+        if entry is None and not self.allowlist_only:
+            local = self._local.get(sha256_hash)
+            if local is not None:
+                entry = local["value"]
+            else:
+                query = self._cache.get(self.KEY_PREFIX + sha256_hash)
+                if query is not None:
+                    entry = self._build(sha256_hash, query)
+                    self._local.set(sha256_hash, entry, ttl=self._ttl)
+        
+        self._stats["hits" if entry is not None else "misses"] += 1
+        return entry
+    
+    def resolve(self, query: Optional[str], sha256_hash: Optional[str]) -> PersistedQuery:
+        """
+        Resolve a request to a registered operation.
+        Hash only: lookup (PERSISTED_QUERY_NOT_FOUND tells the client to resend with text).
+        Hash + text: lookup, else register (APQ) or reject (allowlist).
+        Text only (allowlist): must match a pinned operation.
+        """
+        if sha256_hash is None:
+            sha256_hash = self.hash_query(query)
+        
+        entry = self.lookup(sha256_hash)
+        if entry is not None:
+            return entry
+        
+        if self.allowlist_only:
+            self._stats["rejected"] += 1
+            raise PersistedQueryError("PersistedQueryNotAllowed", "PERSISTED_QUERY_NOT_ALLOWED")
+        if query is None:
+            raise PersistedQueryError("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND")
+        return self.register(query, sha256_hash)
+    
+    def _build(self, sha256_hash: str, query: str) -> PersistedQuery:
+        document = self._analyzer.parse(query)
+        return PersistedQuery(sha256_hash, query, document, self._analyzer._page_size_variables(document))
+    
+    def get_stats(self) -> Dict:
+        """Get registry statistics."""
+        return {
+            **self._stats,
+            "local_size": self._local.size(),
+            "pinned": len(self._pinned),
+            "mode": "allowlist" if self.allowlist_only else "auto"
+        }
+
+# ============================================
+# ENTITY STORE
+# ============================================
+
+class EntityStore:
+    """
+    Normalized entity cache. Query results are split into entity records
+    keyed by typename:id (the invalidation tag, so invalidate_entities()
+    evicts them) holding per-field values with their own expiry; nested
+    entities become {"__ref": key}. Root fields are stored per field+args.
+    
+    read() assembles a query from the store and reports which root fields
+    are incomplete (a requested field, entity or argument combination is
+    missing or expired); reduced_query() prints a query for just those.
+    Records live in MultiLevelCache, so they are shared across replicas.
+    
+    result_format says what execute_fn returns: "envelope" (a {"data",
+    "errors"} dict or an object with .data) or bare "data". Results are
+    read and store answers built (wrap()) in that format.
+    """
+    
+    KEY_PREFIX = "graphql:entity:"
+    ROOT_PREFIX = "graphql:entity:root:"
+    REF = "__ref"
+    OBJECT = "__obj"
+    
+    RESULT_FORMATS = ("envelope", "data")
+    
+    def __init__(self, cache: MultiLevelCache, ttl: int = 60, redirects: Dict[str, str] = None,
+                 result_format: str = "envelope"):
+        if result_format not in self.RESULT_FORMATS:
+            raise ValueError(f"Unknown execute result format: {result_format}")
+        self._cache = cache
+        self.result_format = result_format
+        self.ttl = ttl
+        self.redirects = dict(redirects or {})  # Root field name -> __typename
+        self._stats = {
+            "reads": 0,
+            "full_hits": 0,
+            "partial_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "entities_written": 0
+        }
+    
+    @staticmethod
+    def entity_key(typename: str, entity_id: Any) -> str:
+        return f"{typename.lower()}:{entity_id}"
+    
+    @staticmethod
+    def supports(document: GraphQLDocument) -> bool:
+        """Single query operations whose root selections are plain fields."""
+        return (len(document.operations) == 1
+                and document.operations[0].operation == "query"
+                and all(isinstance(s, GraphQLField) for s in document.operations[0].selections))
+    
+    # Field identity
+    
+    @classmethod
+    def _storage_key(cls, selection: GraphQLField, variables: Dict) -> str:
+        if not selection.arguments:
+            return selection.name
+        arguments = {name: cls._resolve(value, variables) for name, value in selection.arguments.items()}
+        return selection.name + _Canonicalizer.arguments(arguments)
+    
+    @classmethod
+    def _resolve(cls, value: Any, variables: Dict) -> Any:
+        """Substitute variables in an argument value."""
+        if isinstance(value, GraphQLVariable):
+            return variables.get(value.name)
+        if isinstance(value, list):
+            return [cls._resolve(v, variables) for v in value]
+        if isinstance(value, dict):
+            return {k: cls._resolve(v, variables) for k, v in value.items()}
+        return value
+    
+    @staticmethod
+    def _variables(operation: GraphQLOperation, variables: Optional[Dict]) -> Dict:
+        """Request variables with operation defaults applied."""
+        resolved = {name: default for name, (_, default) in operation.variables.items() if default is not None}
+        resolved.update(variables or {})
+        return resolved
+    
+    def _fields(self, selections: List[Any], document: GraphQLDocument, typename: Optional[str],
+                variables: Dict, visited: frozenset = frozenset()):
+        """
+        Yield the fields applying to an object of typename, expanding
+        fragments. Yields None for selections that can't be decided without
+        a schema (type conditions other than typename, unknown directives).
+        """
+        for selection in selections:
+            included = self._included(selection.directives, variables)
+            if included is None:
+                yield None
+                continue
+            if not included:
+                continue
+            if isinstance(selection, GraphQLField):
+                yield selection
+                continue
+            if isinstance(selection, GraphQLFragmentSpread):
+                fragment = document.fragments.get(selection.name)
+                if fragment is None or selection.name in visited:
+                    yield None
+                    continue
+                type_condition, selections = fragment.type_condition, fragment.selections
+                visited = visited | {selection.name}
+            else:
+                type_condition, selections = selection.type_condition, selection.selections
+            if type_condition is not None and type_condition != typename:
+                yield None  # Interface/union condition: needs the schema
+                continue
+            yield from self._fields(selections, document, typename, variables, visited)
+    
+    @classmethod
+    def _included(cls, directives: List[tuple], variables: Dict) -> Optional[bool]:
+        """Evaluate @include/@skip; None for directives the store can't honour."""
+        for name, arguments in directives:
+            if name not in ("include", "skip"):
+                return None
+            condition = bool(cls._resolve(arguments.get("if"), variables))
+            if condition != (name == "include"):
+                return False
+        return True
+    
+    # Writing
+    
+    def write(self, document: GraphQLDocument, variables: Optional[Dict], result: Any) -> set:
+        """Normalize a query result into the store. Returns the keys of the entities written."""
+        data = self.unwrap(result)
+        if not isinstance(data, dict) or not self.supports(document):
+            return set()
+        operation = document.operations[0]
+        variables = self._variables(operation, variables)
+        expires = time.time() + self.ttl
+        
+        entities: Dict[str, Dict[str, Any]] = {}
+        roots: Dict[str, Any] = {}
+        for selection in self._fields(operation.selections, document, None, variables):
+            if selection is None:
+                continue  # Unknown directive: read() treats the field as missing
+            response_key = selection.alias or selection.name
+            if response_key not in data:
+                continue
+            value = data[response_key]
+            if selection.selections:
+                value = self._normalize(selection.selections, document, variables, value, entities, expires)
+            roots[self.ROOT_PREFIX + self._storage_key(selection, variables)] = value
+        
+        # Merge into existing records (fields not in this result keep theirs)
+        keys = [self.KEY_PREFIX + key for key in entities]
+        existing = self._cache.get_many(keys)
+        records = {}
+        for key, cache_key in zip(entities, keys):
+            record = existing.get(cache_key) or {"fields": {}}
+            record["fields"].update(entities[key])
+            records[cache_key] = record
+        self._cache.set_many(records, ttl=self.ttl, tags={self.KEY_PREFIX + k: [k] for k in entities})
+        self._cache.set_many(roots, ttl=self.ttl)
+        
+        self._stats["writes"] += 1
+        self._stats["entities_written"] += len(entities)
+        return set(entities)
+    
+    def _normalize(self, selections: List[Any], document: GraphQLDocument, variables: Dict,
+                   value: Any, entities: Dict, expires: float) -> Any:
+        if isinstance(value, list):
+            return [self._normalize(selections, document, variables, v, entities, expires) for v in value]
+        if not isinstance(value, dict):
+            return value
+        
+        typename = value.get("__typename")
+        fields = {}
+        for selection in self._fields(selections, document, typename, variables):
+            if selection is None:
+                continue
+            response_key = selection.alias or selection.name
+            if response_key not in value:
+                continue
+            field_value = value[response_key]
+            if selection.selections:
+                field_value = self._normalize(selection.selections, document, variables, field_value, entities, expires)
+            fields[self._storage_key(selection, variables)] = field_value
+        
+        if typename is not None and value.get("id") is not None:
+            key = self.entity_key(typename, value["id"])
+            record = entities.setdefault(key, {})
+            for storage_key, field_value in fields.items():
+                record[storage_key] = [field_value, expires]
+            record["__typename"] = [typename, expires]
+            return {self.REF: key}
+        return {self.OBJECT: fields}
+    
+    def unwrap(self, result: Any) -> Any:
+        """The data of an execute_fn result."""
+        if self.result_format == "data":
+            return result
+        return result.get("data") if isinstance(result, dict) else getattr(result, "data", None)
+    
+    def wrap(self, data: Dict[str, Any]) -> Any:
+        """A store answer in the format execute_fn returns."""
+        return {"data": data} if self.result_format == "envelope" else data
+    
+    # Reading
+    
+    def read(self, document: GraphQLDocument, variables: Optional[Dict]) -> tuple[Dict[str, Any], List[str], set]:
+        """
+        Assemble the query from the store. Returns (data, missing, entities):
+        the incomplete root response keys and the entity keys read.
+        """
+        self._stats["reads"] += 1
+        operation = document.operations[0]
+        variables = self._variables(operation, variables)
+        
+        fields = list(self._fields(operation.selections, document, None, variables))
+        if None in fields:
+            self._stats["misses"] += 1
+            return {}, [s.alias or s.name for s in operation.selections], set()
+        
+        root_keys = [self.ROOT_PREFIX + self._storage_key(f, variables) for f in fields]
+        roots = self._cache.get_many(root_keys)
+        records: Dict[str, Any] = {}
+        
+        data: Dict[str, Any] = {}
+        missing: List[str] = []
+        for selection, root_key in zip(fields, root_keys):
+            response_key = selection.alias or selection.name
+            if root_key in roots:
+                value = roots[root_key]
+            elif selection.name in self.redirects and "id" in selection.arguments:
+                entity_id = self._resolve(selection.arguments["id"], variables)
+                value = {self.REF: self.entity_key(self.redirects[selection.name], entity_id)}
+            else:
+                missing.append(response_key)
+                continue
+            
+            complete = [True]
+            if selection.selections:
+                value = self._denormalize(selection.selections, document, variables, value, records, complete)
+            if complete[0]:
+                data[response_key] = value
+            else:
+                missing.append(response_key)
+        
+        if not missing:
+            self._stats["full_hits"] += 1
+        elif data:
+            self._stats["partial_hits"] += 1
+        else:
+            self._stats["misses"] += 1
+        entities = {key[len(self.KEY_PREFIX):] for key, record in records.items() if record is not None}
+        return data, missing, entities
+    
+    def _denormalize(self, selections: List[Any], document: GraphQLDocument, variables: Dict,
+                     value: Any, records: Dict[str, Any], complete: List[bool]) -> Any:
+        if isinstance(value, list):
+            # Fetch all referenced records in one round trip
+            refs = [self.KEY_PREFIX + v[self.REF] for v in value
+                    if isinstance(v, dict) and self.REF in v and self.KEY_PREFIX + v[self.REF] not in records]
+            if refs:
+                records.update(self._cache.get_many(refs))
+            return [self._denormalize(selections, document, variables, v, records, complete) for v in value]
+        if not isinstance(value, dict):
+            return value
+        
+        now = time.time()
+        if self.REF in value:
+            cache_key = self.KEY_PREFIX + value[self.REF]
+            if cache_key not in records:
+                records[cache_key] = self._cache.get(cache_key)
+            record = records[cache_key]
+            if record is None:
+                complete[0] = False
+                return None
+            stored = record["fields"]
+            
+            def lookup(storage_key):
+                entry = stored.get(storage_key)
+                return (True, entry[0]) if entry is not None and entry[1] > now else (False, None)
+            
+            typename = lookup("__typename")[1]
+        else:
+            stored = value.get(self.OBJECT, {})
+            
+            def lookup(storage_key):
+                return (True, stored[storage_key]) if storage_key in stored else (False, None)
+            
+            typename = stored.get("__typename")
+        
+        result = {}
+        for selection in self._fields(selections, document, typename, variables):
+            if selection is None:
+                complete[0] = False
+                return None
+            found, field_value = lookup(self._storage_key(selection, variables))
+            if not found:
+                complete[0] = False
+                return None
+            if selection.selections:
+                field_value = self._denormalize(selection.selections, document, variables, field_value, records, complete)
+            result[selection.alias or selection.name] = field_value
+        return result
+    
+    def reduced_query(self, document: GraphQLDocument, response_keys: List[str]) -> tuple[str, set]:
+        """
+        Query text selecting only the given root fields, with the fragments
+        they use. Returns (query, names of the variables it declares).
+        """
+        operation = document.operations[0]
+        selections = [s for s in operation.selections if (s.alias or s.name) in response_keys]
+        
+        used_variables: set = set()
+        used_fragments: Dict[str, GraphQLFragment] = {}
+        
+        def collect_value(value):
+            if isinstance(value, GraphQLVariable):
+                used_variables.add(value.name)
+            elif isinstance(value, list):
+                for v in value:
+                    collect_value(v)
+            elif isinstance(value, dict):
+                for v in value.values():
+                    collect_value(v)
+        
+        def collect(items):
+            for item in items:
+                for _, arguments in item.directives:
+                    collect_value(arguments)
+                if isinstance(item, GraphQLField):
+                    collect_value(item.arguments)
+                    collect(item.selections)
+                elif isinstance(item, GraphQLFragmentSpread):
+                    fragment = document.fragments.get(item.name)
+                    if fragment is not None and item.name not in used_fragments:
+                        used_fragments[item.name] = fragment
+                        collect(fragment.selections)
+                else:
+                    collect(item.selections)
+        
+        collect(selections)
+        reduced = GraphQLOperation(
+            "query", operation.name,
+            {name: definition for name, definition in operation.variables.items() if name in used_variables},
+            [], selections
+        )
+        return _Canonicalizer.document([reduced], used_fragments), set(reduced.variables)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self._stats, "redirects": len(self.redirects)}
 
 # ============================================
 # PERFORMANCE MONITOR
 # ============================================
 
+class LatencyHistogram:
+    """
+    HDR-style latency histogram: log-spaced buckets with fixed relative
+    error (precision), O(1) record, sparse storage, mergeable.
+    """
+    
+    def __init__(self, precision: float = 0.01, min_value_ms: float = 0.01):
+        self._precision = precision
+        self._min_value = min_value_ms
+        self._log_base = math.log1p(precision)
+        self._counts: Dict[int, int] = defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def record(self, value_ms: float):
+        if value_ms <= self._min_value:
+            index = 0
+        else:
+            index = int(math.log(value_ms / self._min_value) / self._log_base) + 1
+        self._counts[index] += 1
+        self.count += 1
+        self.total += value_ms
+        if value_ms > self.max:
+            self.max = value_ms
+    
+    def merge(self, other: "LatencyHistogram"):
+        for index, count in other._counts.items():
+            self._counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+    
+    def percentile(self, p: float) -> float:
+        """Value at percentile p (0-100), within the configured relative error."""
+        if self.count == 0:
+            return 0.0
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= rank:
+                if index == 0:
+                    return min(self._min_value, self.max)
+                # Geometric midpoint of the bucket, capped by the observed max
+                value = self._min_value * (1 + self._precision) ** (index - 0.5)
+                return min(value, self.max)
+        return self.max
+    
+    def cumulative_counts(self, bounds_ms: List[float]) -> List[int]:
+        """Observations <= each bound (ascending bounds), for Prometheus-style buckets."""
+        cutoffs = [
+            0 if bound <= self._min_value else int(math.log(bound / self._min_value) / self._log_base)
+            for bound in bounds_ms
+        ]
+        results = []
+        seen = 0
+        indexes = sorted(self._counts)
+        position = 0
+        for cutoff in cutoffs:
+            while position < len(indexes) and indexes[position] <= cutoff:
+                seen += self._counts[indexes[position]]
+                position += 1
+            results.append(seen)
+        return results
+    
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "avg": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50": round(self.percentile(50), 3),
+            "p95": round(self.percentile(95), 3),
+            "p99": round(self.percentile(99), 3),
+            "max": round(self.max, 3)
+        }
+
 class PerformanceMonitor:
-    """Real-time performance monitoring for GraphQL."""
+    """
+    Real-time performance monitoring for GraphQL.
+    Recording is O(1): window aggregates go into per-second buckets,
+    latency into per-operation histograms and slow queries into a bounded
+    top-k heap. Individual metrics (and their traces) are kept only there.
+    """
+    
+    WINDOW_SECONDS = 300
+    SLOW_QUERY_CAPACITY = 100
+    MAX_OPERATIONS = 200  # Per-operation histograms beyond this share "__other__"
     
     def __init__(self, config: MonitoringConfig = None):
         self.config = config or MonitoringConfig()
         
-        # Metrics storage
-        self._queries: List[QueryMetrics] = []
         self._lock = threading.Lock()
         
+        # Per-second buckets over the window: [second, count, time_ms, errors, cache_hits, cache_total]
+        self._buckets: List[List[float]] = [[-1, 0, 0.0, 0, 0, 0] for _ in range(self.WINDOW_SECONDS)]
+        
+        # Latency sketches
+        self._latency = LatencyHistogram()
+        self._operation_latency: Dict[str, LatencyHistogram] = {}
+        
+        # Slowest queries (min-heap of (time_ms, seq, metrics))
+        self._slow_heap: List[tuple] = []
+        self._seq = 0
+        
+        # Complexity distribution
+        self._distribution = {k.value: 0 for k in QueryComplexity}
+        
         # Aggregated metrics
         self._aggregated = {
             "total_queries": 0,
@@ -508,8 +3541,24 @@ class PerformanceMonitor:
         # Slow query threshold
         self.slow_query_threshold_ms = config.slow_query_threshold_ms if config else 1000
         
-        # Alert callbacks
+        # Alert callbacks, dispatched off the request path by a worker thread
         self._alert_callbacks: List[Callable] = []
+        self._alert_queue: "queue.Queue[tuple]" = queue.Queue(maxsize=self.config.alert_queue_size)
+        self._alert_groups: Dict[tuple, Dict[str, Any]] = {}
+        self._queued_alerts: Dict[tuple, int] = {}  # (kind, operation) -> repeats while queued
+        self._queued_lock = threading.Lock()
+        self._alert_buckets: Dict[int, List[float]] = {}  # id(callback) -> [tokens, last_refill]
+        self._alert_stats = {
+            "enqueued": 0,
+            "dropped": 0,
+            "suppressed": 0,
+            "rate_limited": 0,
+            "sent": 0,
+            "callback_errors": 0
+        }
+        self._alert_thread = threading.Thread(target=self._alert_loop, name="graphql-alerts")
+        self._alert_thread.daemon = True
+        self._alert_thread.start()
         
         # Start monitoring
         self._running = True
@@ -519,32 +3568,153 @@ class PerformanceMonitor:
     
     def record_query(self, metrics: QueryMetrics):
         """Record a query execution."""
+        now = int(time.time())
+        alerts = []
         with self._lock:
-            self._queries.append(metrics)
+            # Window buckets
+            bucket = self._buckets[now % self.WINDOW_SECONDS]
+            if bucket[0] != now:
+                bucket[:] = [now, 0, 0.0, 0, 0, 0]
+            bucket[1] += 1
+            bucket[2] += metrics.execution_time_ms
+            bucket[3] += metrics.error_count
+            bucket[4] += metrics.cache_hits
+            bucket[5] += metrics.cache_hits + metrics.cache_misses
             
-            # Keep only last 10000 queries
-            if len(self._queries) > 10000:
-                self._queries = self._queries[-10000:]
+            # Latency
+            self._latency.record(metrics.execution_time_ms)
+            self._operation_histogram(metrics.operation_name).record(metrics.execution_time_ms)
+            
+            # Top-k slowest
+            self._seq += 1
+            item = (metrics.execution_time_ms, self._seq, metrics)
+            if len(self._slow_heap) < self.SLOW_QUERY_CAPACITY:
+                heapq.heappush(self._slow_heap, item)
+            elif item[0] > self._slow_heap[0][0]:
+                heapq.heapreplace(self._slow_heap, item)
+            
+            self._distribution[metrics.complexity.value] += 1
             
             # Check for slow queries
             if metrics.execution_time_ms > self.slow_query_threshold_ms:
-                self._alert(f"Slow query detected: {metrics.execution_time_ms:.2f}ms for {metrics.operation_name}")
+                alerts.append(("slow_query", metrics.operation_name,
+                               f"Slow query detected: {metrics.execution_time_ms:.2f}ms for {metrics.operation_name}"))
             
             # Check error rate
             if metrics.error_count > 0:
-                self._alert(f"Query with errors: {metrics.operation_name}")
+                alerts.append(("query_errors", metrics.operation_name,
+                               f"Query with errors: {metrics.operation_name}"))
+        
+        # Enqueue outside the lock; dispatch happens on the alert thread
+        for kind, operation, message in alerts:
+            self._alert(message, kind, operation)
+    
+    def _operation_histogram(self, operation_name: str) -> LatencyHistogram:
+        """Histogram for operation, bounded to MAX_OPERATIONS names. Caller holds the lock."""
+        histogram = self._operation_latency.get(operation_name)
+        if histogram is None:
+            if len(self._operation_latency) >= self.MAX_OPERATIONS:
+                operation_name = "__other__"
+                histogram = self._operation_latency.get(operation_name)
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self._operation_latency[operation_name] = histogram
+        return histogram
+    
+    def register_alert_callback(self, callback: Callable[[str], None]):
+        """Register alert callback."""
+        self._alert_callbacks.append(callback)
+    
+    def _alert(self, message: str, kind: str = "generic", operation: str = ""):
+        """Queue alert for background dispatch. Never blocks; drops when the queue is full."""
+        if not self.config.enable_alerting or not self._alert_callbacks:
+            return
+        key = (kind, operation)
+        with self._queued_lock:
+            if key in self._queued_alerts:
+                # Same alert already waiting: fold it in instead of queueing a duplicate
+                self._queued_alerts[key] += 1
+                return
+            try:
+                self._alert_queue.put_nowait((kind, operation, message, time.monotonic()))
+                self._queued_alerts[key] = 0
+                self._alert_stats["enqueued"] += 1
+            except queue.Full:
+                self._alert_stats["dropped"] += 1
+    
+    def _alert_loop(self):
+        """Drain alert queue: dedupe per (kind, operation) within the window, then dispatch."""
+        while True:
+            try:
+                item = self._alert_queue.get(timeout=1.0)
+            except queue.Empty:
+                item = None
+            
+            if item is not None:
+                try:
+                    self._handle_alert(*item)
+                finally:
+                    self._alert_queue.task_done()
+            self._flush_alert_groups(time.monotonic())
+    
+    def _handle_alert(self, kind: str, operation: str, message: str, at: float):
+        """First alert per group in a window is sent; repeats are counted and summarized."""
+        key = (kind, operation)
+        with self._queued_lock:
+            repeats = self._queued_alerts.pop(key, 0)
+        self._alert_stats["suppressed"] += repeats
+        
+        group = self._alert_groups.get(key)
+        if group is not None and at - group["first"] < self.config.alert_dedup_window_seconds:
+            group["suppressed"] += 1 + repeats
+            group["last_message"] = message
+            self._alert_stats["suppressed"] += 1
+            return
+        
+        if group is not None:
+            self._send_group_summary(group)
+        self._alert_groups[key] = {"first": at, "suppressed": repeats, "last_message": message}
+        self._dispatch_alert(message)
+    
+    def _flush_alert_groups(self, now: float):
+        """Close expired groups, sending a summary for any that suppressed repeats."""
+        expired = [key for key, group in self._alert_groups.items()
+                   if now - group["first"] >= self.config.alert_dedup_window_seconds]
+        for key in expired:
+            self._send_group_summary(self._alert_groups.pop(key))
     
-    def register_alert_callback(self, callback: Callable[[str], None]):
-        """Register alert callback."""
-        self._alert_callbacks.append(callback)
+    def _send_group_summary(self, group: Dict[str, Any]):
+        if group["suppressed"]:
+            self._dispatch_alert(
+                f"{group['last_message']} (repeated {group['suppressed']}x in "
+                f"{self.config.alert_dedup_window_seconds}s)"
+            )
     
-    def _alert(self, message: str):
-        """Send alert."""
-        for callback in self._alert_callbacks:
+    def _dispatch_alert(self, message: str):
+        """Send to each callback subject to its per-minute token bucket."""
+        now = time.monotonic()
+        rate = self.config.alert_rate_limit_per_minute
+        for callback in list(self._alert_callbacks):
+            bucket = self._alert_buckets.setdefault(id(callback), [float(rate), now])
+            bucket[0] = min(rate, bucket[0] + (now - bucket[1]) * rate / 60)
+            bucket[1] = now
+            if bucket[0] < 1:
+                self._alert_stats["rate_limited"] += 1
+                continue
+            bucket[0] -= 1
             try:
                 callback(message)
+                self._alert_stats["sent"] += 1
             except Exception:
-                pass
+                self._alert_stats["callback_errors"] += 1
+    
+    def flush_alerts(self):
+        """Block until queued alerts have been processed (tests/shutdown)."""
+        self._alert_queue.join()
+    
+    def get_alert_stats(self) -> Dict[str, int]:
+        """Alert dispatch counters."""
+        return {**self._alert_stats, "queued": self._alert_queue.qsize()}
     
     def _aggregate_loop(self):
         """Aggregate metrics in background."""
@@ -552,31 +3722,29 @@ class PerformanceMonitor:
             time.sleep(self.config.metrics_interval_seconds)
             self._aggregate()
     
+    def _window_totals(self, seconds: int) -> List[float]:
+        """Sum bucket fields over the last `seconds`. Caller holds the lock."""
+        now = int(time.time())
+        totals = [0, 0.0, 0, 0, 0]
+        for bucket in self._buckets:
+            if now - seconds < bucket[0] <= now:
+                for i in range(5):
+                    totals[i] += bucket[i + 1]
+        return totals
+    
     def _aggregate(self):
         """Aggregate recent metrics."""
         with self._lock:
-            if not self._queries:
-                return
-            
-            now = datetime.now()
-            recent = [q for q in self._queries 
-                     if now - q.timestamp < timedelta(minutes=5)]
-            
-            if not recent:
+            count, total_time, total_errors, total_cache_hits, total_cache = self._window_totals(self.WINDOW_SECONDS)
+            if not count:
                 return
             
-            # Calculate aggregates
-            total_time = sum(q.execution_time_ms for q in recent)
-            total_errors = sum(q.error_count for q in recent)
-            total_cache_hits = sum(q.cache_hits for q in recent)
-            total_cache = sum(q.cache_hits + q.cache_misses for q in recent)
-            
             self._aggregated = {
-                "total_queries": len(recent),
-                "avg_execution_time_ms": total_time / len(recent),
+                "total_queries": count,
+                "avg_execution_time_ms": total_time / count,
                 "total_errors": total_errors,
                 "cache_hit_rate": (total_cache_hits / total_cache * 100) if total_cache > 0 else 0,
-                "queries_per_second": len(recent) / 300
+                "queries_per_second": count / self.WINDOW_SECONDS
             }
     
     def get_metrics(self) -> Dict:
@@ -584,24 +3752,33 @@ class PerformanceMonitor:
         with self._lock:
             return {
                 "aggregated": self._aggregated,
-                "recent_queries": len([q for q in self._queries 
-                                     if datetime.now() - q.timestamp < timedelta(seconds=60)])
+                "recent_queries": int(self._window_totals(60)[0]),
+                "latency_ms": self._latency.summary()
+            }
+    
+    def get_latency_histogram(self, bounds_ms: List[float]) -> Dict[str, Any]:
+        """Cumulative bucket counts, sum and count of all query latencies."""
+        with self._lock:
+            return {
+                "buckets": self._latency.cumulative_counts(bounds_ms),
+                "sum_ms": self._latency.total,
+                "count": self._latency.count
             }
     
+    def get_operation_latency(self) -> Dict[str, Dict[str, float]]:
+        """p50/p95/p99 latency per operation."""
+        with self._lock:
+            return {name: h.summary() for name, h in self._operation_latency.items()}
+    
     def get_slow_queries(self, limit: int = 10) -> List[QueryMetrics]:
         """Get slowest queries."""
         with self._lock:
-            return sorted(self._queries, 
-                        key=lambda q: q.execution_time_ms, 
-                        reverse=True)[:limit]
+            return [item[2] for item in heapq.nlargest(limit, self._slow_heap)]
     
     def get_query_distribution(self) -> Dict:
         """Get query complexity distribution."""
         with self._lock:
-            distribution = {k.value: 0 for k in QueryComplexity}
-            for q in self._queries:
-                distribution[q.complexity.value] += 1
-            return distribution
+            return dict(self._distribution)
 
 # ============================================
 # CIRCUIT BREAKER
@@ -615,71 +3792,428 @@ class CircuitState(Enum):
 class CircuitBreaker:
     """
     Circuit breaker for protecting against cascade failures.
+    
+    Trips when, over a sliding window of the last window_size calls
+    (window_type="count") or seconds (window_type="time"), the failure rate
+    or the slow-call rate reaches its threshold - once minimum_calls have
+    been seen. HALF_OPEN admits at most half_open_max_calls concurrent probes.
     """
     
     def __init__(self, name: str, failure_threshold: int = 5, 
-                 recovery_timeout_seconds: int = 30):
+                 recovery_timeout_seconds: int = 30,
+                 failure_rate_threshold: float = 0.5,
+                 window_type: str = "count",
+                 window_size: int = 20,
+                 minimum_calls: Optional[int] = None,
+                 slow_call_duration_ms: Optional[float] = None,
+                 slow_call_rate_threshold: float = 1.0,
+                 half_open_max_calls: int = 1,
+                 call_timeout_seconds: Optional[float] = None,
+                 failure_exceptions: tuple = (Exception,)):
+        if window_type not in ("count", "time"):
+            raise ValueError(f"Unknown window type: {window_type}")
+        
         self.name = name
         self.failure_threshold = failure_threshold
         self.recovery_timeout = timedelta(seconds=recovery_timeout_seconds)
+        self.failure_rate_threshold = failure_rate_threshold
+        self.window_type = window_type
+        self.window_size = window_size
+        self.minimum_calls = minimum_calls if minimum_calls is not None else failure_threshold
+        self.slow_call_duration_ms = slow_call_duration_ms
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.half_open_max_calls = half_open_max_calls
+        self.call_timeout_seconds = call_timeout_seconds
+        self.failure_exceptions = failure_exceptions
         
         self._state = CircuitState.CLOSED
-        self._failure_count = 0
+        self._opened_at = 0.0  # monotonic
         self._last_failure: Optional[datetime] = None
         self._lock = threading.Lock()
+        
+        # Sliding window of (monotonic time, failed, slow) with running totals
+        self._window: Deque[tuple] = deque()
+        self._window_failures = 0
+        self._window_slow = 0
+        
+        # HALF_OPEN probes
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        
+        self._stats = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "slow_calls": 0,
+            "timeouts": 0,
+            "rejected": 0
+        }
+        self._transitions: Dict[tuple, int] = defaultdict(int)
     
     @property
     def state(self) -> CircuitState:
         """Get current state."""
-        if self._state == CircuitState.OPEN:
-            if self._last_failure and datetime.now() - self._last_failure > self.recovery_timeout:
-                self._state = CircuitState.HALF_OPEN
-        return self._state
+        with self._lock:
+            self._check_recovery()
+            return self._state
     
     def call(self, fn: Callable, *args, **kwargs) -> Any:
-        """Execute function with circuit breaker protection."""
-        if self.state == CircuitState.OPEN:
-            raise CircuitOpenError(f"Circuit {self.name} is open")
-        
+        """
+        Execute function with circuit breaker protection.
+        Sync calls can't be interrupted; calls exceeding call_timeout_seconds
+        are recorded as failures after they return.
+        """
+        probe = self._acquire()
+        start = time.perf_counter()
         try:
             result = fn(*args, **kwargs)
-            self._on_success()
-            return result
-        except Exception as e:
-            self._on_failure()
+        except self.failure_exceptions:
+            self._record(probe, time.perf_counter() - start, failed=True)
+            raise
+        except BaseException:
+            self._release(probe)
+            raise
+        elapsed = time.perf_counter() - start
+        timed_out = self.call_timeout_seconds is not None and elapsed > self.call_timeout_seconds
+        if timed_out:
+            self._stats["timeouts"] += 1
+        self._record(probe, elapsed, failed=timed_out)
+        return result
+    
+    async def call_async(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Await fn(*args, **kwargs) with circuit breaker protection, cancelling
+        it after call_timeout_seconds (raises asyncio.TimeoutError).
+        """
+        probe = self._acquire()
+        start = time.perf_counter()
+        try:
+            if self.call_timeout_seconds is not None:
+                result = await asyncio.wait_for(fn(*args, **kwargs), self.call_timeout_seconds)
+            else:
+                result = await fn(*args, **kwargs)
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            self._record(probe, time.perf_counter() - start, failed=True)
+            raise
+        except self.failure_exceptions:
+            self._record(probe, time.perf_counter() - start, failed=True)
             raise
+        except BaseException:
+            # Cancellation of the caller isn't the dependency's fault
+            self._release(probe)
+            raise
+        self._record(probe, time.perf_counter() - start, failed=False)
+        return result
     
-    def _on_success(self):
-        """Handle successful call."""
+    def _acquire(self) -> bool:
+        """Admit a call or raise CircuitOpenError. Returns True for a HALF_OPEN probe."""
         with self._lock:
-            if self._state == CircuitState.HALF_OPEN:
-                self._state = CircuitState.CLOSED
-                self._failure_count = 0
+            self._check_recovery()
+            if self._state == CircuitState.CLOSED:
+                return False
+            if self._state == CircuitState.HALF_OPEN and self._probes_in_flight < self.half_open_max_calls:
+                self._probes_in_flight += 1
+                return True
+            self._stats["rejected"] += 1
+        raise CircuitOpenError(f"Circuit {self.name} is {self._state.value}")
+    
+    def _release(self, probe: bool):
+        """Give back a probe slot without recording an outcome."""
+        if probe:
+            with self._lock:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
     
-    def _on_failure(self):
-        """Handle failed call."""
+    def _record(self, probe: bool, elapsed_seconds: float, failed: bool):
+        """Record a call outcome and apply state transitions."""
+        slow = (self.slow_call_duration_ms is not None
+                and elapsed_seconds * 1000 >= self.slow_call_duration_ms)
         with self._lock:
-            self._failure_count += 1
-            self._last_failure = datetime.now()
+            self._stats["calls"] += 1
+            self._stats["failures" if failed else "successes"] += 1
+            if slow:
+                self._stats["slow_calls"] += 1
+            if failed:
+                self._last_failure = datetime.now()
+            
+            if probe:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if self._state != CircuitState.HALF_OPEN:
+                    return
+                if failed or slow:
+                    self._transition(CircuitState.OPEN)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_max_calls:
+                        self._transition(CircuitState.CLOSED)
+                return
             
-            if self._failure_count >= self.failure_threshold:
-                self._state = CircuitState.OPEN
+            if self._state != CircuitState.CLOSED:
+                return
+            now = time.monotonic()
+            self._window.append((now, failed, slow))
+            self._window_failures += failed
+            self._window_slow += slow
+            self._trim_window(now)
+            
+            calls = len(self._window)
+            if calls >= self.minimum_calls and (
+                self._window_failures / calls >= self.failure_rate_threshold
+                or (self.slow_call_duration_ms is not None
+                    and self._window_slow / calls >= self.slow_call_rate_threshold)
+            ):
+                self._transition(CircuitState.OPEN)
+    
+    def _trim_window(self, now: float):
+        """Drop outcomes outside the sliding window. Caller holds the lock."""
+        window = self._window
+        if self.window_type == "count":
+            while len(window) > self.window_size:
+                _, failed, slow = window.popleft()
+                self._window_failures -= failed
+                self._window_slow -= slow
+        else:
+            cutoff = now - self.window_size
+            while window and window[0][0] < cutoff:
+                _, failed, slow = window.popleft()
+                self._window_failures -= failed
+                self._window_slow -= slow
+    
+    def _check_recovery(self):
+        """OPEN -> HALF_OPEN once recovery_timeout has elapsed. Caller holds the lock."""
+        if (self._state == CircuitState.OPEN
+                and time.monotonic() - self._opened_at >= self.recovery_timeout.total_seconds()):
+            self._transition(CircuitState.HALF_OPEN)
+    
+    def _transition(self, state: CircuitState):
+        """Move to state, resetting window/probe bookkeeping. Caller holds the lock."""
+        previous = self._state
+        if previous == state:
+            return
+        self._state = state
+        self._transitions[(previous.value, state.value)] += 1
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        if state == CircuitState.OPEN:
+            self._opened_at = time.monotonic()
+        else:
+            self._window.clear()
+            self._window_failures = 0
+            self._window_slow = 0
+        log = logging.warning if state == CircuitState.OPEN else logging.info
+        log(f"Circuit {self.name}: {previous.value} -> {state.value}")
     
     def reset(self):
         """Reset circuit breaker."""
         with self._lock:
-            self._state = CircuitState.CLOSED
-            self._failure_count = 0
+            self._transition(CircuitState.CLOSED)
+            self._window.clear()
+            self._window_failures = 0
+            self._window_slow = 0
             self._last_failure = None
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Call outcomes, current window rates and state transition counts."""
+        with self._lock:
+            self._check_recovery()
+            self._trim_window(time.monotonic())
+            calls = len(self._window)
+            return {
+                "state": self._state.value,
+                **self._stats,
+                "window_calls": calls,
+                "failure_rate": self._window_failures / calls if calls else 0.0,
+                "slow_call_rate": self._window_slow / calls if calls else 0.0,
+                "transitions": {f"{a}->{b}": n for (a, b), n in self._transitions.items()}
+            }
 
 class CircuitOpenError(Exception):
     """Raised when circuit breaker is open."""
     pass
 
+# ============================================
+# ADMISSION CONTROL
+# ============================================
+
+class _AdmissionWaiter:
+    __slots__ = ("weight", "event", "admitted")
+    
+    def __init__(self, weight: int):
+        self.weight = weight
+        self.event = threading.Event()
+        self.admitted = False
+
+class AdmissionController:
+    """
+    Adaptive concurrency limit in front of query execution.
+    
+    Each execution takes weight = ceil(complexity / cost_unit) units (capped
+    at the current limit). The limit follows a gradient rule: it shrinks
+    when recent latency rises above the long-term average and grows by
+    sqrt(limit) while latency holds. When saturated, low-priority work is
+    shed and the rest waits in a bounded FIFO queue.
+    """
+    
+    LONG_WINDOW = 600  # Samples in the long-term latency average
+    SHORT_WINDOW = 10
+    TOLERANCE = 1.5  # Latency growth tolerated before shrinking
+    SMOOTHING = 0.2
+    
+    def __init__(self, initial_limit: int = 20, min_limit: int = 4, max_limit: int = 200,
+                 cost_unit: int = 25, queue_size: int = 100, queue_timeout_ms: int = 1000):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.cost_unit = cost_unit
+        self.queue_size = queue_size
+        self.queue_timeout_ms = queue_timeout_ms
+        
+        self._limit = float(initial_limit)
+        self._inflight = 0
+        self._queue: Deque[_AdmissionWaiter] = deque()
+        self._lock = threading.Lock()
+        
+        self._long_rtt: Optional[float] = None
+        self._short_rtt: Optional[float] = None
+        
+        self._stats = {
+            "admitted": 0,
+            "queued": 0,
+            "shed": 0,
+            "queue_full": 0,
+            "queue_timeouts": 0,
+            "max_queue_depth": 0
+        }
+    
+    def weight(self, complexity: int) -> int:
+        return max(1, math.ceil(complexity / self.cost_unit))
+    
+    def acquire(self, weight: int, low_priority: bool = False) -> int:
+        """
+        Take weight units, waiting in the queue if needed. Returns the units
+        actually taken (pass to release). Raises QueryLimitError when shed.
+        """
+        with self._lock:
+            weight = min(weight, max(1, int(self._limit)))
+            if not self._queue and self._inflight + weight <= self._limit:
+                self._inflight += weight
+                self._stats["admitted"] += 1
+                return weight
+            if low_priority:
+                self._stats["shed"] += 1
+                raise QueryLimitError("Server busy: low-priority query shed", "OVERLOADED")
+            if len(self._queue) >= self.queue_size:
+                self._stats["queue_full"] += 1
+                raise QueryLimitError("Server busy: admission queue full", "OVERLOADED")
+            waiter = _AdmissionWaiter(weight)
+            self._queue.append(waiter)
+            self._stats["queued"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], len(self._queue))
+        
+        waiter.event.wait(self.queue_timeout_ms / 1000)
+        with self._lock:
+            if waiter.admitted:
+                return waiter.weight  # Recapped by _drain() against the limit at admission
+            self._queue.remove(waiter)
+            self._stats["queue_timeouts"] += 1
+            self._drain()  # The head may have been blocking smaller waiters
+        raise QueryLimitError(f"Server busy: queued for more than {self.queue_timeout_ms}ms", "OVERLOADED")
+    
+    def release(self, weight: int, latency_ms: float):
+        """Return units and feed the latency sample into the limit."""
+        with self._lock:
+            self._inflight -= weight
+            self._update_limit(latency_ms)
+            self._drain()
+    
+    def _drain(self):
+        """Admit queued waiters in order while they fit. Caller holds the lock."""
+        while self._queue:
+            waiter = self._queue[0]
+            weight = min(waiter.weight, max(1, int(self._limit)))
+            if self._inflight + weight > self._limit:
+                break
+            self._queue.popleft()
+            self._inflight += weight
+            waiter.weight = weight
+            waiter.admitted = True
+            self._stats["admitted"] += 1
+            waiter.event.set()
+    
+    def _update_limit(self, latency_ms: float):
+        """Gradient update from one latency sample. Caller holds the lock."""
+        rtt = max(latency_ms, 0.001)
+        if self._long_rtt is None:
+            self._long_rtt = self._short_rtt = rtt
+            return
+        # The baseline follows overload samples 10x slower, so sustained
+        # queueing can't drag it (and the limit) upward
+        alpha = 2 / (self.LONG_WINDOW + 1)
+        if rtt > self.TOLERANCE * self._long_rtt:
+            alpha /= 10
+        self._long_rtt += (rtt - self._long_rtt) * alpha
+        self._short_rtt += (rtt - self._short_rtt) * 2 / (self.SHORT_WINDOW + 1)
+        
+        # Recovering from a latency spike: let the baseline catch up
+        if self._long_rtt / self._short_rtt > 2:
+            self._long_rtt *= 0.95
+        
+        # Don't grow the limit while it isn't the constraint
+        if self._inflight + 1 < self._limit / 2 and not self._queue:
+            return
+        
+        gradient = max(0.5, min(1.0, self.TOLERANCE * self._long_rtt / self._short_rtt))
+        target = self._limit * gradient + math.sqrt(self._limit)
+        limit = self._limit * (1 - self.SMOOTHING) + target * self.SMOOTHING
+        self._limit = max(self.min_limit, min(self.max_limit, limit))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "limit": round(self._limit, 2),
+                "inflight": self._inflight,
+                "queue_depth": len(self._queue),
+                "long_rtt_ms": round(self._long_rtt or 0.0, 3),
+                "short_rtt_ms": round(self._short_rtt or 0.0, 3)
+            }
+
 # ============================================
 # MAIN OPTIMIZER CLASS
 # ============================================
 
+@dataclass
+class PreparedQuery:
+    """A query that passed resolution and limits, ready to execute."""
+    query: str
+    cache_key: str
+    document: GraphQLDocument
+    analysis: Dict[str, Any]
+    
+    @property
+    def operation_name(self) -> str:
+        for operation in self.document.operations:
+            if operation.name:
+                return operation.name
+        return "anonymous"
+    
+    @property
+    def complexity(self) -> QueryComplexity:
+        return QueryComplexity(self.analysis["level"])
+    
+    @property
+    def read_only(self) -> bool:
+        """Only query operations, so safe to share, cache and re-run."""
+        return all(operation.operation == "query" for operation in self.document.operations)
+
+class _InFlightQuery:
+    """Shared outcome of one in-flight execution (single-flight)."""
+    __slots__ = ("done", "result", "error")
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
 class GraphQLEPerformanceOptimizer:
     """
     Complete GraphQL Performance Optimizer.
@@ -698,90 +4232,554 @@ class GraphQLEPerformanceOptimizer:
         # Core components
         self.cache = MultiLevelCache(self.cache_config)
         self.monitor = PerformanceMonitor(self.monitoring_config)
+        self.tracer = Tracer(self.monitoring_config)
+        self.entity_store = EntityStore(
+            self.cache, ttl=self.query_config.cache_ttl, redirects=self.query_config.entity_redirects,
+            result_format=self.query_config.execute_result_format
+        ) if self.query_config.enable_entity_store else None
+        self.admission = AdmissionController(
+            initial_limit=self.query_config.admission_initial_limit,
+            min_limit=self.query_config.admission_min_limit,
+            max_limit=self.query_config.admission_max_limit,
+            cost_unit=self.query_config.admission_cost_unit,
+            queue_size=self.query_config.admission_queue_size,
+            queue_timeout_ms=self.query_config.admission_queue_timeout_ms
+        ) if self.query_config.enable_admission_control else None
         self.complexity_analyzer = QueryComplexityAnalyzer(
             max_depth=self.query_config.max_depth,
             max_complexity=self.query_config.max_complexity
         )
+        self.persisted_queries = PersistedQueryRegistry(
+            self.cache,
+            self.complexity_analyzer,
+            allowlist_only=self.query_config.persisted_query_mode == "allowlist",
+            ttl=self.query_config.persisted_query_ttl
+        )
         
-        # DataLoaders (managed per request)
-        self._loaders: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        # DataLoaders: definitions plus shared long-lived cache/stats per name.
+        # Instances are created per request inside request_scope().
+        self._loader_specs: Dict[str, tuple] = {}
+        self._loader_caches: Dict[str, LRUCache] = {}
+        self._loader_stats: Dict[str, Dict[str, int]] = {}
+        self._loaders: Dict[str, DataLoader] = {}  # Fallback outside a request scope
         
         # Circuit breakers
         self._circuit_breakers: Dict[str, CircuitBreaker] = {}
         
+        # In-flight executions by cache key (single-flight)
+        self._inflight: Dict[str, _InFlightQuery] = {}
+        self._inflight_lock = threading.Lock()
+        
+        # Background refreshes of stale responses (stale-while-revalidate)
+        self._refreshing: set = set()
+        self._refresh_executor: Optional[ThreadPoolExecutor] = None
+        
         # Statistics
         self._stats = {
             "queries_optimized": 0,
             "n1_problems_prevented": 0,
             "cache_savings_ms": 0,
-            "total_queries": 0
+            "total_queries": 0,
+            "queries_coalesced": 0,
+            "coalesce_timeouts": 0,
+            "stale_served": 0,
+            "refreshes_completed": 0,
+            "refreshes_failed": 0,
+            "refreshes_skipped": 0
         }
     
-    def create_loader(self, name: str, batch_fn: Callable) -> DataLoader:
-        """Create a new DataLoader."""
-        loader = DataLoader(name, batch_fn)
-        self._loaders[name] = loader
-        return loader
+    def create_loader(self, name: str, batch_fn: Callable,
+                      config: DataLoaderConfig = None) -> DataLoader:
+        """
+        Register a DataLoader.
+        Returns the loader for the current request scope (or the process-wide
+        fallback when called outside one). Registering a name again updates
+        its batch_fn/config but keeps the shared cache and stats.
+        """
+        config = config or DataLoaderConfig()
+        self._loader_specs[name] = (batch_fn, config)
+        if name not in self._loader_caches:
+            self._loader_caches[name] = LRUCache(max_size=10000)
+            self._loader_stats[name] = DataLoader._empty_stats()
+        self._loaders.pop(name, None)
+        return self.get_loader(name)
     
     def get_loader(self, name: str) -> Optional[DataLoader]:
-        """Get existing DataLoader."""
-        return self._loaders.get(name)
+        """Get DataLoader for the current request scope."""
+        scope = _loader_scope.get()
+        if scope is not None and scope.owner is self:
+            return scope.get(name)
+        
+        # Outside a scope there is no request to bound a request cache, so the
+        # process-wide loader only uses the shared TTL'd LRU
+        loader = self._loaders.get(name)
+        if loader is None:
+            loader = self._new_loader(name, request_cache=False)
+            if loader is not None:
+                logging.warning(f"DataLoader {name} used outside request_scope(): "
+                                f"no request cache, only the shared TTL cache")
+                self._loaders[name] = loader
+        return loader
+    
+    def _new_loader(self, name: str, request_cache: bool = True) -> Optional[DataLoader]:
+        """Build a loader instance sharing the long-lived cache for name."""
+        spec = self._loader_specs.get(name)
+        if spec is None:
+            return None
+        batch_fn, config = spec
+        return DataLoader(name, batch_fn, config,
+                          cache=self._loader_caches[name],
+                          stats=self._loader_stats[name],
+                          persistent_cache=self.cache if config.enable_persistent_cache else None,
+                          request_cache=request_cache)
+    
+    @contextmanager
+    def request_scope(self):
+        """
+        Scope DataLoaders to one request.
+        
+            with optimizer.request_scope():
+                await optimizer.get_loader("users").load(user_id)
+        
+        Tasks started inside the block inherit the scope through contextvars.
+        """
+        scope = LoaderScope(self)
+        token = _loader_scope.set(scope)
+        try:
+            yield scope
+        finally:
+            _loader_scope.reset(token)
+            scope.close()
     
     def execute_query(self, 
-                     query: str,
+                     query: str = None,
                      variables: Dict = None,
-                     execute_fn: Callable = None) -> Dict:
+                     execute_fn: Callable = None,
+                     extensions: Dict = None) -> Dict:
         """
         Execute query with all optimizations.
+        extensions may carry an APQ {"persistedQuery": {"version": 1, "sha256Hash": ...}},
+        in which case query can be omitted once the hash is registered.
         """
-        # Analyze query
-        allowed, reason = self.complexity_analyzer.should_allow(query, variables)
-        if not allowed:
-            return {"error": reason, "allowed": False}
+        # Resolve and analyze query
+        error, prepared = self._prepare(query, variables, extensions)
+        if error is not None:
+            return error
         
-        # Check cache
-        cache_key = self._generate_cache_key(query, variables)
-        cached = self.cache.get(cache_key)
+        # Check cache (mutation responses are never cached or replayed)
+        cached = self.cache.get(prepared.cache_key) if prepared.read_only else None
         if cached and self.query_config.enable_query_caching:
             self._stats["cache_savings_ms"] += 100  # Estimated savings
-            return {"data": cached, "cached": True}
+            data, fresh = self._unwrap_response(cached)
+            if not fresh:
+                self._stats["stale_served"] += 1
+                self._schedule_refresh(prepared, variables, execute_fn)
+                return {"data": data, "cached": True, "stale": True}
+            return {"data": data, "cached": True}
         
         # Execute (if function provided)
         if execute_fn:
-            result = execute_fn(query, variables)
-            
-            # Cache result
-            if self.query_config.enable_response_caching:
-                self.cache.set(cache_key, result, ttl=self.query_config.cache_ttl)
-            
+            try:
+                if self.query_config.enable_request_coalescing and prepared.read_only:
+                    return self._execute_coalesced(prepared, variables, execute_fn)
+                result, _ = self._execute(prepared, variables, execute_fn)
+                return {"data": result, "cached": False}
+            except QueryLimitError as e:
+                return {"error": str(e), "code": e.code, "allowed": e.code != "OVERLOADED"}
+        
+        return {"allowed": True, "message": "Query would execute"}
+    
+    def _execute(self, prepared: "PreparedQuery", variables: Optional[Dict],
+                 execute_fn: Callable, cache_result: bool = True,
+                 low_priority: bool = False) -> tuple[Any, Optional[set]]:
+        """
+        Run execute_fn inside an ExecutionContext, cache and record the result.
+        Returns (result, entity tags to cache it under, or None if it mustn't be).
+        Goes through admission control first; HIGH/CRITICAL queries (and
+        low_priority work such as background refreshes) are shed rather
+        than queued when saturated. Raises QueryLimitError.
+        """
+        admitted = 0
+        if self.admission is not None:
+            admitted = self.admission.acquire(
+                self.admission.weight(prepared.analysis["complexity"]),
+                low_priority=low_priority or prepared.complexity in (QueryComplexity.HIGH, QueryComplexity.CRITICAL)
+            )
+        started = time.perf_counter()
+        try:
+            return self._run(prepared, variables, execute_fn, cache_result)
+        finally:
+            if admitted:
+                self.admission.release(admitted, (time.perf_counter() - started) * 1000)
+    
+    def _run(self, prepared: "PreparedQuery", variables: Optional[Dict],
+             execute_fn: Callable, cache_result: bool) -> tuple[Any, Optional[set]]:
+        """Execute within an ExecutionContext enforcing the query limits."""
+        limits = self.query_config
+        ctx = ExecutionContext(operation_name=prepared.operation_name,
+                               trace=self.tracer.start(prepared.operation_name),
+                               max_resolvers=limits.max_resolvers,
+                               max_db_queries=limits.max_db_queries)
+        ctx.deadline = ctx.wall_start + limits.max_execution_time_ms / 1000
+        
+        # Optional allocation sampling. tracemalloc slows every allocation in
+        # the process while tracing and its peak is process-wide, so it runs
+        # only for the sampled execution and one sample at a time (a sample
+        # overlapping another is skipped)
+        memory_start = None
+        started_tracing = False
+        rate = self.monitoring_config.memory_sample_rate
+        if rate > 0 and random.random() < rate and _memory_sample_lock.acquire(blocking=False):
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        
+        token = _execution_context.set(ctx)
+        try:
+            if ctx.trace is None:
+                result, entities = self._resolve(prepared, variables, execute_fn)
+            else:
+                with ctx.trace.span("execute", prepared.operation_name, cache_key=prepared.cache_key):
+                    result, entities = self._resolve(prepared, variables, execute_fn)
+            ctx.error_count += self._count_errors(result)
+        except Exception:
+            ctx.error_count += 1
+            raise
+        finally:
+            _execution_context.reset(token)
+            ctx.finish()
+            if memory_start is not None:
+                ctx.memory_bytes = max(0, tracemalloc.get_traced_memory()[1] - memory_start)
+                if started_tracing:
+                    tracemalloc.stop()
+                _memory_sample_lock.release()
             # Record metrics
-            self._record_metrics(query, result)
+            self._record_metrics(ctx, prepared)
+        
+        # Cache result (tags None: not cacheable)
+        tags = None
+        if prepared.read_only and self.query_config.enable_response_caching:
+            tags = self._entity_tags(result, entities)
+            if cache_result and tags is not None:
+                self.cache.set(prepared.cache_key, self._wrap_response(result),
+                               ttl=self._response_hard_ttl(), tags=tags)
+        
+        return result, tags
+    
+    @staticmethod
+    def entity_tag(typename: str, entity_id: Any) -> str:
+        """Invalidation tag of an entity, e.g. entity_tag("Lead", 42) -> "lead:42"."""
+        return EntityStore.entity_key(typename, entity_id)
+    
+    def _entity_tags(self, result: Any, entities: Iterable[str] = ()) -> Optional[set]:
+        """
+        Tags of all entities ({"__typename", "id"} objects) in a result, plus
+        the given entity store keys (store-assembled responses may omit
+        __typename). None when the response is too entity-heavy to tag (and
+        so isn't cached).
+        """
+        tags: set = set()
+        if not self.query_config.enable_entity_tags:
+            return tags
+        
+        limit = self.query_config.max_entity_tags
+        tags.update(entities)
+        if len(tags) > limit:
+            return None
+        stack = [result]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                typename = node.get("__typename")
+                if typename is not None and node.get("id") is not None:
+                    tags.add(self.entity_tag(typename, node["id"]))
+                    if len(tags) > limit:
+                        return None
+                stack.extend(v for v in node.values() if isinstance(v, (dict, list)))
+            elif isinstance(node, list):
+                stack.extend(v for v in node if isinstance(v, (dict, list)))
+        return tags
+    
+    def invalidate_entities(self, entities: Iterable[str]) -> int:
+        """
+        Evict cached responses containing any of the entities ("lead:42",
+        "template:7" or ("Lead", 42) tuples). Returns responses invalidated.
+        """
+        tags = []
+        for entity in entities:
+            parts = entity if isinstance(entity, tuple) else str(entity).split(":", 1)
+            if len(parts) != 2 or not parts[0] or parts[1] in ("", None):
+                raise ValueError(f"Entity must be 'typename:id' or a (typename, id) tuple, got {entity!r}")
+            tags.append(self.entity_tag(*parts))
+        return self.cache.invalidate_tags(tags)
+    
+    def _resolve(self, prepared: "PreparedQuery", variables: Optional[Dict],
+                 execute_fn: Callable) -> tuple[Any, set]:
+        """
+        Produce the result, from the entity store where it is complete.
+        Only incomplete root fields are sent to execute_fn; the response is
+        then re-assembled from the store. Falls back to executing the full
+        query when the fetched part can't be normalized or has errors.
+        Returns (result, keys of the store entities it was built from).
+        """
+        store = self.entity_store
+        if store is None or not store.supports(prepared.document):
+            return execute_fn(prepared.query, variables), set()
+        
+        data, missing, entities = store.read(prepared.document, variables)
+        if not missing:
+            return store.wrap(data), entities
+        
+        if data:
+            # Partial hit: fetch just the missing root fields
+            reduced, used = store.reduced_query(prepared.document, missing)
+            result = execute_fn(reduced, {k: v for k, v in (variables or {}).items() if k in used})
+            if not self._count_errors(result):
+                store.write(prepared.document, variables, result)
+                data, missing, entities = store.read(prepared.document, variables)
+                if not missing:
+                    return store.wrap(data), entities
+        
+        result = execute_fn(prepared.query, variables)
+        if self._count_errors(result):
+            return result, set()
+        return result, store.write(prepared.document, variables, result)
+    
+    @staticmethod
+    def _count_errors(result: Any) -> int:
+        """GraphQL errors in an execution result ({"errors": [...]} or result.errors)."""
+        errors = result.get("errors") if isinstance(result, dict) else getattr(result, "errors", None)
+        return len(errors) if isinstance(errors, (list, tuple)) else 0
+    
+    def _response_hard_ttl(self) -> int:
+        """Lifetime of a cached response: soft TTL (cache_ttl) plus the stale window."""
+        return self.query_config.cache_ttl + self.query_config.stale_ttl
+    
+    def _wrap_response(self, result: Any) -> Dict:
+        """Cache envelope recording when the response stops being fresh (wall clock, shared via Redis)."""
+        return {"data": result, "fresh_until": time.time() + self.query_config.cache_ttl}
+    
+    @staticmethod
+    def _unwrap_response(entry: Any) -> tuple[Any, bool]:
+        """Return (data, is_fresh) for a cached response."""
+        if isinstance(entry, dict) and "fresh_until" in entry and "data" in entry:
+            return entry["data"], time.time() < entry["fresh_until"]
+        return entry, True
+    
+    def _schedule_refresh(self, prepared: "PreparedQuery", variables: Optional[Dict],
+                          execute_fn: Optional[Callable]):
+        """Refresh a stale response in the background, bounded by max_concurrent_refreshes."""
+        if execute_fn is None or not prepared.read_only:
+            return
+        
+        cache_key = prepared.cache_key
+        with self._inflight_lock:
+            if cache_key in self._refreshing or cache_key in self._inflight:
+                return
+            if len(self._refreshing) >= self.query_config.max_concurrent_refreshes:
+                self._stats["refreshes_skipped"] += 1
+                return
+            self._refreshing.add(cache_key)
+            if self._refresh_executor is None:
+                self._refresh_executor = ThreadPoolExecutor(
+                    max_workers=self.query_config.max_concurrent_refreshes,
+                    thread_name_prefix="graphql-refresh"
+                )
+        
+        self._refresh_executor.submit(self._refresh, prepared, variables, execute_fn)
+    
+    def _refresh(self, prepared: "PreparedQuery", variables: Optional[Dict],
+                 execute_fn: Callable):
+        """Background refresh worker."""
+        try:
+            self._execute(prepared, variables, execute_fn, low_priority=True)
+            self._stats["refreshes_completed"] += 1
+        except QueryLimitError as e:
+            self._stats["refreshes_skipped" if e.code == "OVERLOADED" else "refreshes_failed"] += 1
+        except Exception as e:
+            self._stats["refreshes_failed"] += 1
+            logging.warning(f"Background refresh failed for {prepared.cache_key}: {e}")
+        finally:
+            with self._inflight_lock:
+                self._refreshing.discard(prepared.cache_key)
+    
+    def _execute_coalesced(self, prepared: "PreparedQuery", variables: Optional[Dict],
+                           execute_fn: Callable) -> Dict:
+        """
+        Single-flight execution: identical concurrent queries share one
+        execute_fn call. Waiters get the leader's result or re-raise its error.
+        Only for read-only documents; mutations always execute individually.
+        """
+        cache_key = prepared.cache_key
+        with self._inflight_lock:
+            flight = self._inflight.get(cache_key)
+            is_leader = flight is None
+            if is_leader:
+                flight = _InFlightQuery()
+                self._inflight[cache_key] = flight
+        
+        if not is_leader:
+            if not flight.done.wait(self.query_config.coalesce_timeout_ms / 1000):
+                self._stats["coalesce_timeouts"] += 1
+                return {
+                    "error": f"Timed out after {self.query_config.coalesce_timeout_ms}ms "
+                             f"waiting for identical in-flight query",
+                    "allowed": True
+                }
+            self._stats["queries_coalesced"] += 1
+            if flight.error is not None:
+                raise flight.error
+            return {"data": flight.result, "cached": False, "coalesced": True}
+        
+        try:
+            flight.result, _ = self._execute(prepared, variables, execute_fn)
+            return {"data": flight.result, "cached": False}
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(cache_key, None)
+            flight.done.set()
+    
+    def execute_batch(self,
+                      operations: List[Dict],
+                      execute_fn: Callable = None) -> List[Dict]:
+        """
+        Execute a batch of operations ({"query": ..., "variables": ..., "extensions": ...}).
+        Response cache lookups for the whole batch share one get_many round
+        trip, and fresh results are written back with one set_many.
+        """
+        responses: List[Optional[Dict]] = [None] * len(operations)
+        prepared_ops: Dict[int, PreparedQuery] = {}
+        
+        # Resolve and analyze queries
+        for i, operation in enumerate(operations):
+            error, prepared = self._prepare(
+                operation.get("query"), operation.get("variables"), operation.get("extensions")
+            )
+            if error is not None:
+                responses[i] = error
+            else:
+                prepared_ops[i] = prepared
+        
+        # Check cache
+        cached: Dict[str, Any] = {}
+        if self.query_config.enable_query_caching and prepared_ops:
+            cached = self.cache.get_many([p.cache_key for p in prepared_ops.values() if p.read_only])
+        
+        # Execute misses (if function provided)
+        fresh: Dict[str, Any] = {}
+        fresh_tags: Dict[str, set] = {}
+        for i, prepared in prepared_ops.items():
+            variables = operations[i].get("variables")
+            if prepared.cache_key in cached:
+                self._stats["cache_savings_ms"] += 100  # Estimated savings
+                data, is_fresh = self._unwrap_response(cached[prepared.cache_key])
+                responses[i] = {"data": data, "cached": True}
+                if not is_fresh:
+                    self._stats["stale_served"] += 1
+                    self._schedule_refresh(prepared, variables, execute_fn)
+                    responses[i]["stale"] = True
+            elif execute_fn:
+                try:
+                    result, tags = self._execute(prepared, variables, execute_fn, cache_result=False)
+                except QueryLimitError as e:
+                    responses[i] = {"error": str(e), "code": e.code, "allowed": e.code != "OVERLOADED"}
+                    continue
+                if tags is not None:
+                    fresh[prepared.cache_key] = self._wrap_response(result)
+                    fresh_tags[prepared.cache_key] = tags
+                responses[i] = {"data": result, "cached": False}
+            else:
+                responses[i] = {"allowed": True, "message": "Query would execute"}
+        
+        # Cache results
+        if fresh and self.query_config.enable_response_caching:
+            self.cache.set_many(fresh, ttl=self._response_hard_ttl(), tags=fresh_tags)
+        
+        return responses
+    
+    def _prepare(self, query: Optional[str], variables: Optional[Dict],
+                 extensions: Optional[Dict]) -> tuple[Optional[Dict], Optional["PreparedQuery"]]:
+        """
+        Resolve persisted queries and apply limits.
+        Returns (error_response, prepared); error_response is None when allowed.
+        """
+        mode = self.query_config.persisted_query_mode
+        sha256_hash = ((extensions or {}).get("persistedQuery") or {}).get("sha256Hash")
+        
+        if mode != "off" and (sha256_hash or mode == "allowlist"):
+            if query is None and sha256_hash is None:
+                return {"error": "No query provided", "allowed": False}, None
+            try:
+                persisted = self.persisted_queries.resolve(query, sha256_hash)
+            except PersistedQueryError as e:
+                return {"error": str(e), "code": e.code, "allowed": False}, None
+            except GraphQLSyntaxError as e:
+                return {"error": f"Syntax error: {e}", "allowed": False}, None
             
-            return {"data": result, "cached": False}
+            analysis = self.complexity_analyzer.analyze_parsed(persisted.document, persisted.page_vars, variables)
+            allowed, reason = self.complexity_analyzer.verdict(analysis)
+            if not allowed:
+                return {"error": reason, "allowed": False}, None
+            return None, PreparedQuery(
+                query=persisted.query,
+                cache_key=self._generate_cache_key(persisted.document, variables),
+                document=persisted.document,
+                analysis=analysis
+            )
         
-        return {"allowed": True, "message": "Query would execute"}
+        if query is None:
+            return {"error": "No query provided", "allowed": False}, None
+        analysis = self.complexity_analyzer.analyze(query, variables)
+        allowed, reason = self.complexity_analyzer.verdict(analysis)
+        if not allowed:
+            return {"error": reason, "allowed": False}, None
+        document = self.complexity_analyzer.parse(query)
+        return None, PreparedQuery(
+            query=query,
+            cache_key=self._generate_cache_key(document, variables),
+            document=document,
+            analysis=analysis
+        )
     
-    def _generate_cache_key(self, query: str, variables: Dict = None) -> str:
-        """Generate cache key for query."""
-        content = query + json.dumps(variables or {}, sort_keys=True)
-        return f"graphql:query:{hashlib.md5(content.encode()).hexdigest()}"
+    def _generate_cache_key(self, document: GraphQLDocument, variables: Dict = None) -> str:
+        """
+        Generate cache key for query: the document fingerprint (so formatting
+        and field/argument order don't matter) plus a separate variables hash.
+        """
+        if not variables:
+            return f"graphql:query:{document.fingerprint}"
+        variables_hash = hashlib.blake2b(
+            json.dumps(variables, sort_keys=True, default=str).encode(), digest_size=12
+        ).hexdigest()
+        return f"graphql:query:{document.fingerprint}:{variables_hash}"
     
-    def _record_metrics(self, query: str, result: Any):
-        """Record query metrics."""
+    def _record_metrics(self, ctx: ExecutionContext, prepared: "PreparedQuery"):
+        """Record query metrics from a finished execution."""
+        trace = None
+        if ctx.trace is not None and self.tracer.finish(ctx.trace, ctx.wall_ms):
+            trace = ctx.trace
+        
         metrics = QueryMetrics(
-            query_hash=self._generate_cache_key(query),
-            operation_name="anonymous",
-            execution_time_ms=0,  # Would be measured in real impl
-            resolver_count=0,
-            db_queries=0,
-            cache_hits=1,
-            cache_misses=0,
-            memory_bytes=0,
-            error_count=0,
+            query_hash=prepared.document.fingerprint,
+            operation_name=ctx.operation_name,
+            execution_time_ms=ctx.wall_ms,
+            resolver_count=ctx.resolver_count,
+            db_queries=ctx.db_queries,
+            cache_hits=ctx.cache_hits,
+            cache_misses=ctx.cache_misses,
+            memory_bytes=ctx.memory_bytes,
+            error_count=ctx.error_count,
             timestamp=datetime.now(),
             variables={},
-            complexity=QueryComplexity.LOW,
-            cache_key=""
+            complexity=prepared.complexity,
+            cache_key=prepared.cache_key,
+            cpu_time_ms=ctx.cpu_ms,
+            trace=trace
         )
         self.monitor.record_query(metrics)
         self._stats["queries_optimized"] += 1
@@ -793,8 +4791,24 @@ class GraphQLEPerformanceOptimizer:
             "monitor": self.monitor.get_metrics(),
             "slow_queries": [self._format_query(q) for q in self.monitor.get_slow_queries(5)],
             "distribution": self.monitor.get_query_distribution(),
+            "operation_latency": self.monitor.get_operation_latency(),
+            "alerts": self.monitor.get_alert_stats(),
+            "analyzer": self.complexity_analyzer.get_stats(),
+            "persisted_queries": self.persisted_queries.get_stats(),
+            "tracing": self.tracer.get_stats(),
+            "circuit_breakers": self.get_circuit_stats(),
+            "admission": self.admission.get_stats() if self.admission is not None else None,
+            "entity_store": self.entity_store.get_stats() if self.entity_store is not None else None,
             "stats": self._stats,
-            "loaders": [l.get_stats() for l in self._loaders.values()]
+            "refreshes": {
+                "in_progress": len(self._refreshing),
+                "completed": self._stats["refreshes_completed"],
+                "failed": self._stats["refreshes_failed"],
+                "skipped": self._stats["refreshes_skipped"],
+                "stale_served": self._stats["stale_served"]
+            },
+            "loaders": [DataLoader._summarize(name, self._loader_stats[name], self._loader_caches[name])
+                        for name in self._loader_specs]
         }
     
     def _format_query(self, query: QueryMetrics) -> Dict:
@@ -803,9 +4817,26 @@ class GraphQLEPerformanceOptimizer:
             "operation": query.operation_name,
             "time_ms": query.execution_time_ms,
             "complexity": query.complexity.value,
-            "cache_hit_rate": f"{query.cache_hit_rate:.1f}%"
+            "cache_hit_rate": f"{query.cache_hit_rate:.1f}%",
+            "trace_id": query.trace.trace_id if query.trace else None
         }
     
+    def export_traces(self, path: str, format: str = "jsonl", slow_only: bool = False) -> int:
+        """
+        Export kept traces as JSON lines or Chrome trace events ("chrome").
+        slow_only limits the export to traces attached to the slowest queries.
+        """
+        traces = None
+        if slow_only:
+            traces = [q.trace for q in self.monitor.get_slow_queries(self.monitor.SLOW_QUERY_CAPACITY) if q.trace]
+        return self.tracer.export(path, format, traces)
+    
+    def start_metrics_exporter(self, host: str = "0.0.0.0") -> Optional["PrometheusExporter"]:
+        """Serve /metrics on monitoring_config.dashboard_port (if enable_dashboard)."""
+        if not self.monitoring_config.enable_dashboard:
+            return None
+        return PrometheusExporter(self, port=self.monitoring_config.dashboard_port, host=host).start()
+    
     def add_circuit_breaker(self, name: str, **kwargs) -> CircuitBreaker:
         """Add circuit breaker for a service."""
         cb = CircuitBreaker(name, **kwargs)
@@ -818,7 +4849,332 @@ class GraphQLEPerformanceOptimizer:
             name: cb.state.value 
             for name, cb in self._circuit_breakers.items()
         }
+    
+    def get_circuit_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Detailed stats of all circuit breakers."""
+        return {name: cb.get_stats() for name, cb in self._circuit_breakers.items()}
+
+
+# ============================================
+# METRICS EXPORTER
+# ============================================
+
+class _MetricWriter:
+    """Accumulates Prometheus text exposition lines, grouped per family with one HELP/TYPE."""
+    
+    def __init__(self):
+        self._families: Dict[str, List[str]] = {}
+    
+    @staticmethod
+    def _labels(labels: Optional[Dict[str, Any]]) -> str:
+        if not labels:
+            return ""
+        parts = []
+        for name, value in labels.items():
+            value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+            parts.append(f'{name}="{value}"')
+        return "{" + ",".join(parts) + "}"
+    
+    def add(self, name: str, metric_type: str, help_text: str, value: float,
+            labels: Dict[str, Any] = None, suffix: str = ""):
+        lines = self._families.get(name)
+        if lines is None:
+            lines = self._families[name] = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+        lines.append(f"{name}{suffix}{self._labels(labels)} {float(value):g}")
+    
+    def render(self) -> str:
+        return "\n".join(line for lines in self._families.values() for line in lines) + "\n"
+
+class PrometheusExporter:
+    """
+    Serves optimizer metrics on /metrics in Prometheus text format.
+    Label cardinality is bounded: per-operation series are limited to the
+    busiest max_operations operations, the rest are folded into "__other__".
+    """
+    
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+    
+    def __init__(self, optimizer: "GraphQLEPerformanceOptimizer", port: int = 9090,
+                 host: str = "0.0.0.0", max_operations: int = 50):
+        self.optimizer = optimizer
+        self.port = port
+        self.host = host
+        self.max_operations = max_operations
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+    
+    def render(self) -> str:
+        """Collect all metrics in exposition format."""
+        w = _MetricWriter()
+        optimizer = self.optimizer
+        
+        # Cache
+        cache = optimizer.cache.get_stats()
+        w.add("graphql_cache_hits_total", "counter", "Response/entity cache hits by level", cache["l1_hits"], {"level": "l1"})
+        w.add("graphql_cache_hits_total", "counter", "Response/entity cache hits by level", cache["l2_hits"], {"level": "l2"})
+        w.add("graphql_cache_hits_total", "counter", "Response/entity cache hits by level", cache["disk_hits"], {"level": "disk"})
+        w.add("graphql_cache_misses_total", "counter", "Cache misses across all levels", cache["misses"])
+        w.add("graphql_cache_l1_entries", "gauge", "Entries in the in-process L1 cache", cache["l1_size"])
+        w.add("graphql_cache_l1_bytes", "gauge", "Estimated bytes held by the L1 cache", cache["l1_bytes"])
+        w.add("graphql_cache_l1_evictions_total", "counter", "L1 evictions", cache["l1_evictions"])
+        w.add("graphql_cache_l1_expirations_total", "counter", "L1 entries expired on read", cache["l1_expirations"])
+        w.add("graphql_cache_l2_round_trips_total", "counter", "Redis round trips", cache["l2_round_trips"])
+        
+        # DataLoaders (one series per registered loader name)
+        for name, stats in optimizer._loader_stats.items():
+            labels = {"loader": name}
+            w.add("graphql_dataloader_batches_total", "counter", "batch_fn calls", stats["batches_executed"], labels)
+            w.add("graphql_dataloader_loaded_total", "counter", "Keys loaded through batch_fn", stats["total_loaded"], labels)
+            w.add("graphql_dataloader_cache_hits_total", "counter", "DataLoader cache hits", stats["cache_hits"], labels)
+            w.add("graphql_dataloader_cache_misses_total", "counter", "DataLoader cache misses", stats["cache_misses"], labels)
+            w.add("graphql_dataloader_persistent_hits_total", "counter", "Keys served from the shared persistent cache",
+                  stats["persistent_hits"], labels)
+            w.add("graphql_dataloader_cancelled_total", "counter", "Keys failed because the execution deadline passed",
+                  stats["cancelled"], labels)
+            w.add("graphql_dataloader_timeouts_total", "counter", "Batch functions cut off by the execution deadline",
+                  stats["timeouts"], labels)
+            w.add("graphql_dataloader_negative_cached_total", "counter", "Keys batch_fn returned None for",
+                  stats["negative_cached"], labels)
+            w.add("graphql_dataloader_primed_total", "counter", "Keys primed from other queries",
+                  stats["primed"], labels)
+        
+        # Circuit breakers
+        for name, breaker in optimizer._circuit_breakers.items():
+            stats = breaker.get_stats()
+            for state in CircuitState:
+                w.add("graphql_circuit_state", "gauge", "1 for the breaker's current state",
+                      1 if state.value == stats["state"] else 0, {"breaker": name, "state": state.value})
+            for outcome in ("successes", "failures", "slow_calls", "timeouts", "rejected"):
+                w.add("graphql_circuit_calls_total", "counter", "Calls through the breaker by outcome",
+                      stats[outcome], {"breaker": name, "outcome": outcome})
+            w.add("graphql_circuit_failure_rate", "gauge", "Failure rate over the breaker's sliding window",
+                  stats["failure_rate"], {"breaker": name})
+            for transition, count in stats["transitions"].items():
+                source, target = transition.split("->")
+                w.add("graphql_circuit_transitions_total", "counter", "Circuit breaker state transitions",
+                      count, {"breaker": name, "from": source, "to": target})
+        
+        # Query latency
+        histogram = optimizer.monitor.get_latency_histogram(self.LATENCY_BUCKETS_MS)
+        name = "graphql_query_duration_seconds"
+        for bound, count in zip(self.LATENCY_BUCKETS_MS, histogram["buckets"]):
+            w.add(name, "histogram", "Query execution time", count, {"le": f"{bound / 1000:g}"}, suffix="_bucket")
+        w.add(name, "histogram", "Query execution time", histogram["count"], {"le": "+Inf"}, suffix="_bucket")
+        w.add(name, "histogram", "Query execution time", histogram["sum_ms"] / 1000, suffix="_sum")
+        w.add(name, "histogram", "Query execution time", histogram["count"], suffix="_count")
+        
+        # The monitor's own "__other__" overflow is merged into the folded totals
+        # rather than ranked, so the label appears once
+        latency = optimizer.monitor.get_operation_latency()
+        overflow = latency.pop("__other__", None)
+        operations = sorted(latency.items(), key=lambda item: item[1]["count"], reverse=True)
+        folded = operations[self.max_operations:] + ([("__other__", overflow)] if overflow else [])
+        other_count = sum(summary["count"] for _, summary in folded)
+        other_sum = sum(summary["sum"] for _, summary in folded)
+        for operation, summary in operations[:self.max_operations]:
+            for key, quantile in (("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99")):
+                w.add("graphql_operation_duration_seconds", "summary", "Per-operation latency quantiles",
+                      summary[key] / 1000, {"operation": operation, "quantile": quantile})
+            w.add("graphql_operation_duration_seconds", "summary", "Per-operation latency quantiles",
+                  summary["sum"] / 1000, {"operation": operation}, suffix="_sum")
+            w.add("graphql_operation_duration_seconds", "summary", "Per-operation latency quantiles",
+                  summary["count"], {"operation": operation}, suffix="_count")
+        if other_count:
+            w.add("graphql_operation_duration_seconds", "summary", "Per-operation latency quantiles",
+                  other_sum / 1000, {"operation": "__other__"}, suffix="_sum")
+            w.add("graphql_operation_duration_seconds", "summary", "Per-operation latency quantiles",
+                  other_count, {"operation": "__other__"}, suffix="_count")
+        
+        distribution = optimizer.monitor.get_query_distribution()
+        for level, count in distribution.items():
+            w.add("graphql_queries_by_complexity_total", "counter", "Queries by complexity level", count, {"level": level})
+        
+        # Optimizer counters
+        stats = optimizer._stats
+        for key in ("queries_optimized", "queries_coalesced", "coalesce_timeouts", "stale_served",
+                    "refreshes_completed", "refreshes_failed", "refreshes_skipped"):
+            w.add(f"graphql_{key}_total", "counter", key.replace("_", " ").capitalize(), stats[key])
+        
+        # Admission control
+        if optimizer.admission is not None:
+            admission = optimizer.admission.get_stats()
+            w.add("graphql_admission_limit", "gauge", "Adaptive concurrency limit (cost units)", admission["limit"])
+            w.add("graphql_admission_inflight", "gauge", "Cost units executing", admission["inflight"])
+            w.add("graphql_admission_queue_depth", "gauge", "Queries waiting for admission", admission["queue_depth"])
+            w.add("graphql_admission_admitted_total", "counter", "Queries admitted", admission["admitted"])
+            for reason in ("shed", "queue_full", "queue_timeouts"):
+                w.add("graphql_admission_rejections_total", "counter", "Queries rejected by admission control",
+                      admission[reason], {"reason": reason})
+        
+        # Alerts
+        for outcome, count in optimizer.monitor.get_alert_stats().items():
+            if outcome != "queued":
+                w.add("graphql_alerts_total", "counter", "Alert dispatch outcomes", count, {"outcome": outcome})
+        
+        return w.render()
+    
+    def start(self) -> "PrometheusExporter":
+        """Serve /metrics from a daemon thread."""
+        exporter = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", exporter.CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="graphql-metrics")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+# ============================================
+# BENCHMARKS
+# ============================================
+
+_REPO_ROOT = Path(__file__).resolve().parent.parent
+
+def _load_benchmark_payloads() -> Dict[str, Any]:
+    """Lead and preview payloads from the repo's sample data."""
+    payloads: Dict[str, Any] = {}
+    
+    leads_csv = _REPO_ROOT / "frontend" / "data" / "leads.csv"
+    if leads_csv.exists():
+        with open(leads_csv, newline="", encoding="utf-8") as f:
+            leads = list(csv.DictReader(f))
+        if leads:
+            payloads["lead"] = leads[0]
+            payloads["lead_list"] = {"leads": leads, "total": len(leads)}
+    
+    template = _REPO_ROOT / "frontend" / "public" / "templates" / "luxury-tech-industrial.html"
+    if template.exists():
+        payloads["preview"] = {
+            "leadId": payloads.get("lead", {}).get("id", "lead-1"),
+            "template": template.stem,
+            "html": template.read_text(encoding="utf-8"),
+            "generatedAt": datetime.now().isoformat()
+        }
+    
+    return payloads
+
+def benchmark_codecs(iterations: int = 500) -> List[Dict[str, Any]]:
+    """Compare L2 codecs against the legacy JSON envelope: size and encode/decode time."""
+    def legacy_encode(value):
+        return json.dumps({
+            "value": value,
+            "expires": (datetime.now() + timedelta(seconds=300)).isoformat()
+        }).encode("utf-8")
+    
+    def legacy_decode(payload):
+        return json.loads(payload)["value"]
+    
+    codecs = {"legacy-json": (legacy_encode, legacy_decode)}
+    serializers = ["json"] + (["msgpack"] if _msgpack is not None else [])
+    for serializer in serializers:
+        for compression in ("none", "gzip", "lzma"):
+            codec = CacheCodec(serializer=serializer, compression=compression)
+            codecs[codec.describe()] = (codec.encode, codec.decode)
+    
+    rows = []
+    for payload_name, value in _load_benchmark_payloads().items():
+        for codec_name, (encode, decode) in codecs.items():
+            encoded = encode(value)
+            
+            start = time.perf_counter()
+            for _ in range(iterations):
+                encode(value)
+            encode_us = (time.perf_counter() - start) / iterations * 1e6
+            
+            start = time.perf_counter()
+            for _ in range(iterations):
+                decode(encoded)
+            decode_us = (time.perf_counter() - start) / iterations * 1e6
+            
+            rows.append({
+                "payload": payload_name,
+                "codec": codec_name,
+                "bytes": len(encoded),
+                "encode_us": round(encode_us, 1),
+                "decode_us": round(decode_us, 1)
+            })
+    return rows
+
+def generate_cache_trace(length: int = 200_000, hot_keys: int = 200, seed: int = 7) -> List[str]:
+    """
+    Synthetic access trace shaped like our traffic: a Zipf-skewed set of hot
+    dashboard queries mixed with one-off lead lookups and periodic long scans.
+    """
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(hot_keys)]
+    trace: List[str] = []
+    next_lead = 0
+    
+    while len(trace) < length:
+        # Steady phase: mostly hot queries, some one-off lookups
+        for _ in range(5000):
+            if rng.random() < 0.7:
+                trace.append(f"dashboard:{rng.choices(range(hot_keys), weights)[0]}")
+            else:
+                trace.append(f"lead:{next_lead}")
+                next_lead += 1
+        # Scan phase: long run of one-off lead lookups
+        for _ in range(rng.randint(1000, 4000)):
+            trace.append(f"lead:{next_lead}")
+            next_lead += 1
+    
+    return trace[:length]
 
+def benchmark_eviction_policies(trace: List[str] = None, cache_size: int = 500) -> List[Dict[str, Any]]:
+    """Replay an access trace through each eviction policy and report hit rates."""
+    trace = trace if trace is not None else generate_cache_trace()
+    rows = []
+    for policy in EVICTION_POLICIES:
+        cache = create_local_cache(policy, max_size=cache_size)
+        start = time.perf_counter()
+        for key in trace:
+            if cache.get(key) is None:
+                cache.set(key, True)
+        elapsed = time.perf_counter() - start
+        stats = cache.get_stats()
+        rows.append({
+            "policy": policy,
+            "cache_size": cache_size,
+            "accesses": len(trace),
+            "hit_rate": f"{stats['hits'] / len(trace) * 100:.1f}%",
+            "evictions": stats["evictions"],
+            "ns_per_access": round(elapsed / len(trace) * 1e9)
+        })
+    return rows
+
+def _print_rows(rows: List[Dict[str, Any]]):
+    """Print benchmark rows as an aligned table."""
+    if not rows:
+        print("   (no data)")
+        return
+    columns = list(rows[0].keys())
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print("   " + "  ".join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print("   " + "  ".join(str(row[c]).ljust(widths[c]) for c in columns))
 
 # ============================================
 # MAIN / CLI
@@ -826,6 +5182,27 @@ class GraphQLEPerformanceOptimizer:
 
 def main():
     """CLI interface for testing."""
+    import argparse
+    parser = argparse.ArgumentParser(description="GraphQL Performance Optimizer")
+    parser.add_argument("--bench", choices=["codecs", "eviction"], help="Run a benchmark instead of the self-test")
+    parser.add_argument("--trace", help="Key trace for --bench eviction (one cache key per line)")
+    parser.add_argument("--cache-size", type=int, default=500, help="Cache size for --bench eviction")
+    args = parser.parse_args()
+    
+    if args.bench == "codecs":
+        print("🗜️ L2 codec benchmark (legacy JSON vs binary/compressed)")
+        _print_rows(benchmark_codecs())
+        return
+    
+    if args.bench == "eviction":
+        trace = None
+        if args.trace:
+            with open(args.trace, encoding="utf-8") as f:
+                trace = [line.strip() for line in f if line.strip()]
+        print("♻️ Eviction policy trace replay")
+        _print_rows(benchmark_eviction_policies(trace, cache_size=args.cache_size))
+        return
+    
     print("=" * 70)
     print("🎯 GraphQL Performance Optimizer")
     print("=" * 70)